@@ -2,18 +2,31 @@ import os
 import re
 import json
 import hashlib
+import asyncio
+import time
+import tempfile
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
-from typing import List, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Iterator, List, Optional
 from pydantic import BaseModel
-import requests
+import httpx
 from dotenv import load_dotenv
 
 from models import MessagePayload, MessageResponse, Contact, MediaUpload
-from supabase_client import db, storage
+from supabase_client import db, adb, astorage, decode_cursor
+from dispatcher import CampaignDispatcher, SendJob, SendResult
+from graph_client import graph
+from campaign_jobs import CampaignJobRunner
+from buffers import MessageLogBuffer, StatusBuffer
+from cache import TTLCache
+from header_handles import HeaderHandleCache
+from media_optimize import MEDIA_KEEP_ORIGINAL, ImageOptimizer, spool_to_path
+from media_registry import MediaRegistry
+from contact_import import ImportFormatError, iter_import_rows
+from payloads import MessagePayloadBuilder
+from personalize import MessageTemplate, RenderClock, compile_template, render_message
 import random
-from datetime import datetime
 
 load_dotenv()
 
@@ -54,73 +67,158 @@ APP_ID = os.getenv("META_APP_ID", "")  # Meta App ID for resumable upload
 
 
 # ==================== HELPER: Upload image to Meta for template header ====================
-def upload_image_to_meta(image_url: str) -> str | None:
+header_handles = HeaderHandleCache()
+META_UPLOAD_CHUNK_BYTES = int(os.getenv("META_UPLOAD_CHUNK_BYTES", str(4 * 1024 * 1024)))
+META_UPLOAD_SPOOL_BYTES = int(os.getenv("META_UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+META_UPLOAD_RETRIES = int(os.getenv("META_UPLOAD_RETRIES", "3"))
+
+
+async def resumable_upload(upload_session_id: str, source, file_size: int, content_type: str) -> str | None:
+    """
+    Send a file to a Meta upload session in META_UPLOAD_CHUNK_BYTES chunks.
+    source is a seekable file. After a failed chunk the session's file_offset
+    is fetched and the upload continues from there instead of from byte 0.
+    Returns the header_handle (h:xxxxx) or None if failed.
+    """
+    upload_url = f"https://graph.facebook.com/{API_VERSION}/{upload_session_id}"
+    auth = {"Authorization": f"OAuth {META_TOKEN}"}
+    offset = 0
+    failures = 0
+    
+    while True:
+        source.seek(offset)
+        chunk = source.read(META_UPLOAD_CHUNK_BYTES)
+        upload_headers = {**auth, "file_offset": str(offset), "Content-Type": content_type}
+        try:
+            upload_response = await graph.post(upload_url, headers=upload_headers, content=chunk, timeout=60)
+            upload_data = upload_response.json()
+            if "h" in upload_data:
+                return upload_data["h"]
+            if upload_response.is_success and "error" not in upload_data and offset + len(chunk) < file_size:
+                offset += len(chunk)
+                continue
+            print(f"⚠️ Upload chunk at {offset} failed: {upload_data}")
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"⚠️ Upload chunk at {offset} failed: {e}")
+        
+        failures += 1
+        if failures > META_UPLOAD_RETRIES:
+            print(f"❌ Upload failed after {failures} attempts")
+            return None
+        
+        # Ask Meta how much of the file it already has and continue from there
+        try:
+            status = await graph.get(upload_url, headers=auth, timeout=30)
+            offset = int(status.json().get("file_offset", offset))
+            print(f"↻ Resuming upload {upload_session_id} at byte {offset}/{file_size}")
+        except (httpx.HTTPError, ValueError, TypeError) as e:
+            print(f"⚠️ Could not read upload offset: {e}")
+            await asyncio.sleep(min(2 ** failures, 10))
+
+
+async def upload_image_to_meta(image_url: str) -> str | None:
     """
     Upload an image to Meta's resumable upload API to get a header_handle.
     This is required for template headers with images.
     
     Returns the header_handle (h:xxxxx) or None if failed.
+    Handles are cached per image (URL + ETag, then SHA-256 of the bytes), so
+    an image already uploaded for another template is not sent again.
     """
     if not META_TOKEN or not APP_ID:
         print("⚠️ META_TOKEN or APP_ID not set, cannot upload image to Meta")
         return None
     
     try:
-        # Step 1: Download the image from our storage
-        print(f"📥 Downloading image: {image_url[:60]}...")
-        img_response = requests.get(image_url, timeout=30)
-        if img_response.status_code != 200:
-            print(f"❌ Failed to download image: {img_response.status_code}")
-            return None
-        
-        image_data = img_response.content
-        file_size = len(image_data)
-        content_type = img_response.headers.get('content-type', 'image/jpeg')
-        
-        print(f"✓ Image downloaded: {file_size} bytes, type: {content_type}")
-        
-        # Step 2: Create upload session
-        session_url = f"https://graph.facebook.com/{API_VERSION}/{APP_ID}/uploads"
-        session_params = {
-            "file_length": file_size,
-            "file_type": content_type,
-            "access_token": META_TOKEN
-        }
-        
-        session_response = requests.post(session_url, params=session_params, timeout=30)
-        session_data = session_response.json()
-        
-        if "id" not in session_data:
-            print(f"❌ Failed to create upload session: {session_data}")
-            return None
-        
-        upload_session_id = session_data["id"]
-        print(f"✓ Upload session created: {upload_session_id}")
-        
-        # Step 3: Upload the file
-        upload_url = f"https://graph.facebook.com/{API_VERSION}/{upload_session_id}"
-        upload_headers = {
-            "Authorization": f"OAuth {META_TOKEN}",
-            "file_offset": "0",
-            "Content-Type": content_type
-        }
+        # Step 0: Same storage object as a previous upload? (HEAD only, no download)
+        etag = None
+        try:
+            head = await graph.request("HEAD", image_url, timeout=10, follow_redirects=True)
+            if head.status_code == 200:
+                etag = head.headers.get("etag")
+        except httpx.HTTPError:
+            pass
+        cached_handle = await header_handles.get_by_url(image_url, etag)
+        if cached_handle:
+            print(f"✓ Header handle cached for {image_url[:60]}")
+            return cached_handle
         
-        upload_response = requests.post(upload_url, headers=upload_headers, data=image_data, timeout=60)
-        upload_data = upload_response.json()
+        # Step 1: Stream the image from our storage into a spooled file
+        # (memory up to META_UPLOAD_SPOOL_BYTES, disk beyond), hashing as it arrives
+        print(f"📥 Downloading image: {image_url[:60]}...")
+        with tempfile.SpooledTemporaryFile(max_size=META_UPLOAD_SPOOL_BYTES) as spool:
+            digest = hashlib.sha256()
+            async with graph.stream("GET", image_url, timeout=30, follow_redirects=True) as img_response:
+                if img_response.status_code != 200:
+                    print(f"❌ Failed to download image: {img_response.status_code}")
+                    return None
+                content_type = img_response.headers.get('content-type', 'image/jpeg')
+                etag = etag or img_response.headers.get("etag")
+                async for block in img_response.aiter_bytes(META_UPLOAD_CHUNK_BYTES):
+                    spool.write(block)
+                    digest.update(block)
+            file_size = spool.tell()
+            
+            print(f"✓ Image downloaded: {file_size} bytes, type: {content_type}")
+            
+            # Same bytes uploaded before (e.g. from another URL)?
+            sha256 = digest.hexdigest()
+            cached_handle = await header_handles.get_by_hash(sha256)
+            if cached_handle:
+                print(f"✓ Header handle cached for sha256 {sha256[:12]}")
+                return cached_handle
+            
+            # Step 2: Create upload session
+            session_url = f"https://graph.facebook.com/{API_VERSION}/{APP_ID}/uploads"
+            session_params = {
+                "file_length": file_size,
+                "file_type": content_type,
+                "access_token": META_TOKEN
+            }
+            
+            session_response = await graph.post(session_url, params=session_params, timeout=30)
+            session_data = session_response.json()
+            
+            if "id" not in session_data:
+                print(f"❌ Failed to create upload session: {session_data}")
+                return None
+            
+            upload_session_id = session_data["id"]
+            print(f"✓ Upload session created: {upload_session_id}")
+            
+            # Step 3: Upload the file in chunks, resuming from Meta's offset on failure
+            header_handle = await resumable_upload(upload_session_id, spool, file_size, content_type)
         
-        if "h" in upload_data:
-            header_handle = upload_data["h"]
+        if header_handle:
             print(f"✅ Image uploaded! Handle: {header_handle[:30]}...")
-            return header_handle
-        else:
-            print(f"❌ Upload failed: {upload_data}")
-            return None
+            await header_handles.put(sha256, header_handle, source_url=image_url, etag=etag,
+                                     file_size=file_size, content_type=content_type)
+        return header_handle
             
     except Exception as e:
         print(f"❌ Image upload exception: {e}")
         return None
 
 
+META_UPLOAD_CONCURRENCY = int(os.getenv("META_UPLOAD_CONCURRENCY", "5"))
+
+
+async def upload_images_to_meta(image_urls: List[str],
+                                concurrency: int = META_UPLOAD_CONCURRENCY) -> List[Optional[str]]:
+    """
+    Upload several images concurrently (at most `concurrency` at a time).
+    Returns header_handles in the same order as image_urls, None per failure.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    
+    async def upload(i: int, image_url: str) -> Optional[str]:
+        async with semaphore:
+            print(f"  📤 Uploading image {i+1}/{len(image_urls)}...")
+            return await upload_image_to_meta(image_url)
+    
+    return await asyncio.gather(*(upload(i, url) for i, url in enumerate(image_urls)))
+
+
 # ==================== HEALTH ====================
 @app.get("/")
 async def health_check():
@@ -154,7 +252,7 @@ async def debug_meta_config():
         try:
             headers = {"Authorization": f"Bearer {META_TOKEN}"}
             url = f"https://graph.facebook.com/{API_VERSION}/{WABA_ID}/message_templates?limit=1"
-            res = requests.get(url, headers=headers, timeout=10)
+            res = await graph.get(url, headers=headers, timeout=10)
             res_data = res.json()
             
             if "error" in res_data:
@@ -184,6 +282,30 @@ async def debug_meta_config():
     }
 
 
+@app.get("/debug/graph-pool")
+async def debug_graph_pool():
+    """Connection pool stats for the shared Graph API client (reuse rate etc.)"""
+    return graph.stats()
+
+
+@app.get("/debug/template-cache")
+async def debug_template_cache():
+    """Hit/miss counters for the Meta template listing cache"""
+    return {"ttl": TEMPLATE_CACHE_TTL, **template_cache.stats()}
+
+
+@app.get("/debug/media-registry")
+async def debug_media_registry():
+    """Campaign images uploaded to Meta by id: uploads, failures, cache hits"""
+    return media_registry.stats()
+
+
+@app.get("/debug/header-handle-cache")
+async def debug_header_handle_cache():
+    """Hit/miss counters for cached Meta header_handles (template image uploads)"""
+    return header_handles.stats()
+
+
 # ==================== AUTH ====================
 class AuthRequest(BaseModel):
     password: str
@@ -201,6 +323,10 @@ async def verify_auth(payload: AuthRequest):
 
 
 # ==================== DECISION ENGINE ====================
+# Images are uploaded to Meta once and sent by media id (link as fallback)
+media_registry = MediaRegistry(f"https://graph.facebook.com/{API_VERSION}/{PHONE_ID}/media", META_TOKEN)
+payload_builder = MessagePayloadBuilder(media_ref=media_registry.media_ref)
+
 @app.post("/send-message", response_model=MessageResponse)
 async def process_and_send(payload: MessagePayload):
     """
@@ -221,59 +347,17 @@ async def process_and_send(payload: MessagePayload):
         "Content-Type": "application/json"
     }
     
-    # Build components based on media count
-    components = []
-    
-    # Body text component (for custom message text)
-    if payload.text_content:
-        components.append({
-            "type": "body",
-            "parameters": [{"type": "text", "text": payload.text_content}]
-        })
-    
-    # Decision Logic: Route based on media count
-    if len(payload.media_urls) > 1:
-        # CAROUSEL: Multiple images
-        template_name = payload.template_name or "bakked_carousel_v1"
-        components.append({
-            "type": "carousel",
-            "cards": [
-                {
-                    "card_index": i,
-                    "components": [{
-                        "type": "header",
-                        "parameters": [{"type": "image", "image": {"link": url}}]
-                    }]
-                } for i, url in enumerate(payload.media_urls[:10])  # Meta limit: 10 cards
-            ]
-        })
-    
-    elif len(payload.media_urls) == 1:
-        # IMAGE CTA: Single image
-        template_name = payload.template_name or "bakked_image_cta_v1"
-        components.insert(0, {
-            "type": "header",
-            "parameters": [{"type": "image", "image": {"link": payload.media_urls[0]}}]
-        })
-        
-    else:
-        # PLAIN TEXT: No images
-        template_name = payload.template_name or "bakked_text_v1"
-
-    # Build final Meta API payload
-    final_payload = {
-        "messaging_product": "whatsapp",
-        "to": payload.recipient.replace("+", ""),  # Meta expects without +
-        "type": "template",
-        "template": {
-            "name": template_name,
-            "language": {"code": "en_US"},
-            "components": components
-        }
-    }
+    # Build the Meta API payload (routing by media count lives in payloads.py)
+    await media_registry.ensure(payload.media_urls)
+    final_payload = payload_builder.build_json(
+        to=payload.recipient,  # Meta expects without +
+        text=payload.text_content,
+        media_urls=payload.media_urls,
+        template_name=payload.template_name
+    )
 
     try:
-        res = requests.post(BASE_URL, headers=headers, json=final_payload, timeout=30)
+        res = await graph.post(BASE_URL, headers=headers, content=final_payload, timeout=30)
         res_data = res.json()
         
         if res.status_code == 200 and "messages" in res_data:
@@ -281,9 +365,9 @@ async def process_and_send(payload: MessagePayload):
             
             # Try to save to database (optional - won't crash if tables don't exist)
             try:
-                contact = db.upsert_contact(phone=payload.recipient)
+                contact = await adb.upsert_contact(phone=payload.recipient)
                 if contact and contact.get("id"):
-                    db.create_message_log(contact_id=contact["id"], wa_id=wa_id)
+                    await adb.create_message_log(contact_id=contact["id"], wa_id=wa_id)
             except Exception as db_error:
                 print(f"⚠️ Database save skipped: {db_error}")
             
@@ -292,37 +376,122 @@ async def process_and_send(payload: MessagePayload):
             error_msg = res_data.get("error", {}).get("message", "Unknown error")
             return MessageResponse(success=False, error=error_msg)
             
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         return MessageResponse(success=False, error=str(e))
 
 
 # ==================== MEDIA UPLOAD ====================
+image_optimizer = ImageOptimizer()
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "64"))
+UPLOAD_MAX_BYTES = UPLOAD_MAX_MB * 1024 * 1024
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from Content-Length, before the body is read"""
+    if request.url.path in ("/upload-media", "/contacts/import"):
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > UPLOAD_MAX_BYTES:
+            return JSONResponse(status_code=413, content={"detail": f"File too large (max {UPLOAD_MAX_MB} MB)"})
+    return await call_next(request)
+
+
 @app.post("/upload-media", response_model=MediaUpload)
 async def upload_media(file: UploadFile = File(...)):
     """
     Upload media to Supabase Storage.
     Returns the public URL for use in WhatsApp messages.
+    The file stays in its spooled temp file (RAM for small files, disk for
+    large ones) and is streamed to storage; nothing reads it whole.
+    Files are deduplicated by SHA-256: re-uploading the same bytes returns
+    the existing URL without storing another copy.
+    JPEG/PNG/WebP images are resized and re-encoded first (see
+    media_optimize); the returned URL is the optimized rendition.
     """
     if not file.content_type or not file.content_type.startswith(("image/", "video/")):
         raise HTTPException(status_code=400, detail="Only image and video files are allowed")
     
-    # Read file content
-    file_content = await file.read()
+    # Size check for uploads sent without a Content-Length
+    size = file.size
+    if size is None:
+        size = file.file.seek(0, os.SEEK_END)
+    if size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large (max {UPLOAD_MAX_MB} MB)")
     
-    # Upload to Supabase
-    public_url = storage.upload_file(
-        file_data=file_content,
-        filename=file.filename or "upload",
-        content_type=file.content_type
-    )
+    filename = file.filename or "upload"
+    sha256 = await astorage.sha256_file(file.file)
+    try:
+        existing = await adb.get_media_by_hash(sha256)
+    except Exception as e:
+        print(f"⚠️ Media hash lookup failed: {e}")
+        existing = None
+    if existing:
+        print(f"♻️ {filename} matches existing media {sha256[:12]}, skipping upload")
+        return MediaUpload(storage_url=existing["storage_url"], filename=filename,
+                           size_bytes=size, deduplicated=True)
+    
+    # Optimize images in the worker pool (None = keep the original as is)
+    optimized = None
+    temp_paths = []
+    try:
+        if image_optimizer.accepts(file.content_type):
+            src_path = await astorage.run(spool_to_path, file.file)
+            temp_paths.append(src_path)
+            optimized = await image_optimizer.optimize(src_path)
+            if optimized:
+                temp_paths.append(optimized.path)
+                print(f"🗜️ {filename}: {size} → {optimized.size_bytes} bytes "
+                      f"({optimized.width}x{optimized.height})")
+        
+        # Upload to Supabase
+        started = time.monotonic()
+        original_url = None
+        if optimized:
+            with open(optimized.path, "rb") as optimized_file:
+                public_url = await astorage.upload_file(
+                    file_data=optimized_file,
+                    filename=os.path.splitext(filename)[0] + ".opt.jpg",
+                    content_type="image/jpeg",
+                    content_hash=sha256
+                )
+            stored_size = optimized.size_bytes
+            if public_url and MEDIA_KEEP_ORIGINAL:
+                original_url = await astorage.upload_file(
+                    file_data=file.file,
+                    filename=filename,
+                    content_type=file.content_type,
+                    content_hash=sha256
+                )
+        else:
+            public_url = await astorage.upload_file(
+                file_data=file.file,
+                filename=filename,
+                content_type=file.content_type,
+                content_hash=sha256
+            )
+            stored_size = size
+        elapsed = time.monotonic() - started
+    finally:
+        for path in temp_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
     
     if not public_url:
         raise HTTPException(status_code=500, detail="Failed to upload file")
     
-    # Save record to database
-    db.save_media_record(storage_url=public_url)
+    bytes_per_sec = round(stored_size / elapsed) if elapsed > 0 else None
+    print(f"📤 Uploaded {filename}: {stored_size} bytes in {elapsed:.2f}s ({(bytes_per_sec or 0) / 1024:.0f} KB/s)")
     
-    return MediaUpload(storage_url=public_url, filename=file.filename or "upload")
+    # Save record to database (keyed by the hash of what the user uploaded)
+    await adb.save_media_record(storage_url=public_url, sha256=sha256, filename=filename,
+                                content_type="image/jpeg" if optimized else file.content_type,
+                                size_bytes=stored_size, original_url=original_url)
+    
+    return MediaUpload(storage_url=public_url, filename=filename,
+                       size_bytes=stored_size, bytes_per_sec=bytes_per_sec,
+                       optimized=optimized is not None, original_url=original_url)
 
 
 # ==================== WEBHOOK ====================
@@ -348,6 +517,7 @@ async def receive_webhook(request: Request):
     """
     Meta Webhook Handler.
     Receives status updates: sent, delivered, read.
+    Message statuses are acked immediately and applied by status_buffer.
     Also handles template status updates (APPROVED, REJECTED, etc.)
     """
     try:
@@ -360,14 +530,13 @@ async def receive_webhook(request: Request):
                     value = change.get("value", {})
                     field = change.get("field", "")
                     
-                    # Handle message status updates
+                    # Handle message status updates (buffered, applied in bulk)
                     for status in value.get("statuses", []):
                         wa_id = status.get("id")
-                        new_status = status.get("status")  # sent, delivered, read
+                        new_status = status.get("status")  # sent, delivered, read, failed
                         
                         if wa_id and new_status:
-                            db.update_message_status(wa_id=wa_id, status=new_status)
-                            print(f"📨 Status update: {wa_id} → {new_status}")
+                            status_buffer.add(wa_id, new_status)
                     
                     # Handle template status updates (message_template_status_update)
                     if field == "message_template_status_update":
@@ -375,9 +544,12 @@ async def receive_webhook(request: Request):
                         template_status = value.get("event")  # APPROVED, REJECTED, PENDING, etc.
                         reason = value.get("reason")
                         
+                        if template_name:
+                            invalidate_template(template_name)
+                        
                         if template_name and template_status:
                             # Update local template status
-                            updated = db.update_template_status_by_meta_name(
+                            updated = await adb.update_template_status_by_meta_name(
                                 meta_name=template_name,
                                 meta_status=template_status,
                                 quality_score=None
@@ -393,16 +565,39 @@ async def receive_webhook(request: Request):
 
 # ==================== CONTACTS API ====================
 @app.get("/contacts")
-async def get_contacts(page: int = 1, limit: int = 100, search: Optional[str] = None):
-    """Get paginated contacts from CRM"""
-    result = db.get_contacts(page=page, limit=limit, search=search)
+async def get_contacts(page: int = 1, limit: int = 100, search: Optional[str] = None,
+                       count_mode: str = Query("exact", pattern="^(exact|planned|estimated|none)$"),
+                       cursor: Optional[str] = None):
+    """
+    Get paginated contacts from CRM.
+    count_mode: exact (default), planned or estimated (cheap planner
+    estimates for large lists) or none (skip the total).
+    cursor: pass the previous response's next_cursor for constant-cost
+    deep paging; page is ignored when a cursor is given.
+    """
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    result = await adb.get_contacts(page=page, limit=limit, search=search, count_mode=count_mode, cursor=cursor)
     return result
 
 
+@app.get("/contacts/search")
+async def search_contacts(q: str, limit: int = Query(20, ge=1, le=100)):
+    """Ranked contact search by name or phone (trigram-indexed)"""
+    try:
+        results = await adb.search_contacts(q, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"contacts": results, "count": len(results)}
+
+
 @app.post("/contacts")
 async def create_contact(contact: Contact):
     """Create or update a contact"""
-    result = db.upsert_contact(
+    result = await adb.upsert_contact(
         phone=contact.phone,
         name=contact.name,
         tags=contact.tags,
@@ -413,10 +608,84 @@ async def create_contact(contact: Contact):
     return result
 
 
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERRORS = 1000  # per-row errors returned in the report
+
+
+@app.post("/contacts/import")
+async def import_contacts(file: UploadFile = File(...)):
+    """
+    Bulk import contacts from a CSV or XLSX export.
+    Rows are streamed from the upload, normalized (E.164 phones, ISO dates)
+    and upserted on phone IMPORT_BATCH_SIZE at a time. Returns counts and a
+    per-row error report (row numbers as in the spreadsheet).
+    """
+    if not db.client:
+        raise HTTPException(status_code=500, detail="Database not connected")
+    
+    started = time.monotonic()
+    total = imported = failed = 0
+    errors = []
+    
+    def report(row: int, phone: Optional[str], error: str):
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"row": row, "phone": phone, "error": error})
+    
+    async def flush(batch: dict):
+        nonlocal imported, failed
+        # batch: phone -> (row numbers, merged contact); duplicates in one
+        # batch are merged since an upsert can't touch the same row twice
+        try:
+            await adb.upsert_contacts_bulk([contact for _, contact in batch.values()])
+            imported += sum(len(rows) for rows, _ in batch.values())
+        except Exception as e:
+            for rows, contact in batch.values():
+                failed += len(rows)
+                for row in rows:
+                    report(row, contact["phone"], f"database: {e}")
+    
+    # Parsing runs on the DB pool, IMPORT_BATCH_SIZE rows at a time
+    rows = adb.iterate(iter_import_rows(file.file, file.filename or ""), batch_size=IMPORT_BATCH_SIZE)
+    batch = {}
+    try:
+        async for parsed in rows:
+            total += 1
+            if parsed.errors:
+                failed += 1
+                report(parsed.row, parsed.raw_phone, "; ".join(parsed.errors))
+                continue
+            phone = parsed.contact["phone"]
+            row_numbers, merged = batch.get(phone, ([], {}))
+            batch[phone] = (row_numbers + [parsed.row], {**merged, **parsed.contact})
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush(batch)
+                batch = {}
+        if batch:
+            await flush(batch)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Segment sizes may have changed
+    group_count_cache.invalidate()
+    
+    elapsed = time.monotonic() - started
+    print(f"📇 Imported {imported}/{total} contacts from {file.filename} in {elapsed:.1f}s ({failed} failed)")
+    return {
+        "success": True,
+        "total_rows": total,
+        "imported": imported,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors),
+        "elapsed_ms": round(elapsed * 1000),
+        "rows_per_sec": round(total / elapsed) if elapsed > 0 else None
+    }
+
+
 @app.delete("/contacts/{contact_id}")
 async def delete_contact(contact_id: str):
     """Delete a contact"""
-    success = db.delete_contact(contact_id)
+    success = await adb.delete_contact(contact_id)
     if not success:
         raise HTTPException(status_code=404, detail="Contact not found")
     return {"success": True}
@@ -452,7 +721,7 @@ async def update_contact(contact_id: str, data: UpdateContactRequest):
         raise HTTPException(status_code=400, detail="No data to update")
     
     try:
-        response = db.client.table("contacts").update(update_data).eq("id", contact_id).execute()
+        response = await adb.run(db.client.table("contacts").update(update_data).eq("id", contact_id).execute)
         if response.data:
             return response.data[0]
         raise HTTPException(status_code=404, detail="Contact not found")
@@ -463,8 +732,8 @@ async def update_contact(contact_id: str, data: UpdateContactRequest):
 # ==================== CAMPAIGNS API ====================
 @app.get("/campaigns")
 async def get_campaigns(limit: int = 50):
-    """Get all campaigns"""
-    campaigns = db.get_campaigns(limit=limit)
+    """Get all campaigns with live delivery funnel counts"""
+    campaigns = await adb.get_campaigns(limit=limit)
     return {"campaigns": campaigns, "count": len(campaigns)}
 
 
@@ -472,7 +741,7 @@ async def get_campaigns(limit: int = 50):
 @app.get("/message-logs")
 async def get_message_logs(limit: int = 100):
     """Get recent message logs with status"""
-    logs = db.get_message_logs(limit=limit)
+    logs = await adb.get_message_logs(limit=limit)
     return {"logs": logs, "count": len(logs)}
 
 
@@ -486,6 +755,31 @@ class TemplateComponent(BaseModel):
     text: Optional[str] = None
     buttons: Optional[List[dict]] = None
 
+# Meta template listings, served from memory between changes. Entries are
+# keyed by template name, plus ALL_TEMPLATES for the full /templates list;
+# webhook status updates and create/delete drop the affected name.
+TEMPLATE_CACHE_TTL = int(os.getenv("TEMPLATE_CACHE_TTL", "300"))
+ALL_TEMPLATES = "*"
+template_cache = TTLCache(ttl=TEMPLATE_CACHE_TTL)
+
+
+def summarize_template(t: dict) -> dict:
+    return {
+        "name": t.get("name"),
+        "status": t.get("status"),
+        "category": t.get("category"),
+        "language": t.get("language"),
+        "id": t.get("id"),
+        "components": t.get("components", [])
+    }
+
+
+def invalidate_template(name: str):
+    """Forget one template and the full listing that contains it"""
+    template_cache.invalidate(name)
+    template_cache.invalidate(ALL_TEMPLATES)
+
+
 class CreateTemplateRequest(BaseModel):
     name: str
     category: str = "MARKETING"  # MARKETING, UTILITY, AUTHENTICATION
@@ -526,7 +820,8 @@ async def create_template(template: CreateTemplateRequest):
     }
     
     try:
-        res = requests.post(TEMPLATE_URL, headers=headers, json=payload, timeout=30)
+        res = await graph.post(TEMPLATE_URL, headers=headers, json=payload, timeout=30)
+        invalidate_template(template.name)
         return res.json()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -534,26 +829,30 @@ async def create_template(template: CreateTemplateRequest):
 
 @app.get("/templates")
 async def list_templates():
-    """List all message templates with their status"""
+    """
+    List all message templates with their status.
+    Cached for TEMPLATE_CACHE_TTL seconds; changes invalidate it early.
+    """
     if not WABA_ID:
         raise HTTPException(status_code=500, detail="WHATSAPP_WABA_ID not configured")
     
+    cached = template_cache.get(ALL_TEMPLATES)
+    if cached is not None:
+        return {"templates": cached, "count": len(cached), "cached": True}
+    
     headers = {"Authorization": f"Bearer {META_TOKEN}"}
     
     try:
-        res = requests.get(TEMPLATE_URL, headers=headers, timeout=30)
+        res = await graph.get(TEMPLATE_URL, headers=headers, timeout=30)
         data = res.json()
         
-        templates = []
-        for t in data.get("data", []):
-            templates.append({
-                "name": t.get("name"),
-                "status": t.get("status"),
-                "category": t.get("category"),
-                "language": t.get("language"),
-                "id": t.get("id"),
-                "components": t.get("components", [])
-            })
+        templates = [summarize_template(t) for t in data.get("data", [])]
+        
+        if res.is_success and "data" in data:
+            template_cache.set(ALL_TEMPLATES, templates)
+            for t in templates:
+                if t["name"]:
+                    template_cache.set(t["name"], t)
         
         return {"templates": templates, "count": len(templates)}
     except Exception as e:
@@ -570,12 +869,17 @@ async def get_template_status(template_name: str):
     url = f"{TEMPLATE_URL}?name={template_name}"
     
     try:
-        res = requests.get(url, headers=headers, timeout=30)
-        data = res.json()
+        t = template_cache.get(template_name)
+        if t is None:
+            res = await graph.get(url, headers=headers, timeout=30)
+            data = res.json()
+            
+            templates = data.get("data", [])
+            if templates:
+                t = summarize_template(templates[0])
+                template_cache.set(template_name, t)
         
-        templates = data.get("data", [])
-        if templates:
-            t = templates[0]
+        if t:
             return {
                 "name": t.get("name"),
                 "status": t.get("status"),
@@ -600,7 +904,8 @@ async def delete_template(template_name: str):
     url = f"{TEMPLATE_URL}?name={template_name}"
     
     try:
-        res = requests.delete(url, headers=headers, timeout=30)
+        res = await graph.delete(url, headers=headers, timeout=30)
+        invalidate_template(template_name)
         return res.json()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -643,55 +948,71 @@ class TestMessageRequest(BaseModel):
     template_name: Optional[str] = None
 
 def replace_placeholders(text: str, contact: dict) -> str:
-    """Replace [Name], [Phone], [Days] with actual values"""
-    result = text
-    result = result.replace("[Name]", contact.get("name") or "Friend")
-    result = result.replace("[Phone]", contact.get("phone") or "")
-    
-    # Calculate days since last visit
-    last_visit = contact.get("last_visit")
-    if last_visit:
-        try:
-            from datetime import datetime
-            lv = datetime.fromisoformat(last_visit.replace("Z", "+00:00"))
-            days = (datetime.now(lv.tzinfo) - lv).days
-            result = result.replace("[Days]", str(days))
-        except:
-            result = result.replace("[Days]", "some")
-    else:
-        result = result.replace("[Days]", "")
+    """Replace [Name], [Phone], [Days] (and contact fields) with actual values"""
+    return render_message(text, contact)
+
+
+def iter_segment_contacts(segment: str, nudge_days: Optional[int] = None) -> Iterator[dict]:
+    """
+    Stream the contacts in a campaign segment: birthday / anniversary (today),
+    nudge (last visit exactly nudge_days ago) or everyone.
+    Pages through contacts with db.iter_contacts, so no full list is held.
+    """
+    today = date.today()
     
-    return result
+    if segment in ("birthday", "anniversary"):
+        # Month-day match runs in the database (indexed dob_md / anniversary_md)
+        field = "dob" if segment == "birthday" else "anniversary"
+        yield from db.iter_contacts(query_filter=db.month_day_filter(field, today))
+    
+    elif segment == "nudge":
+        if nudge_days is None:
+            return
+        # Last visit exactly nudge_days ago, filtered in the database
+        yield from db.iter_contacts(query_filter=db.last_visit_on_filter(today - timedelta(days=nudge_days)))
+    
+    else:
+        # Everyone
+        yield from db.iter_contacts()
+
+
+# Segment counts change slowly; cache them briefly for the dashboard tiles
+group_count_cache = TTLCache(ttl=int(os.getenv("GROUP_COUNT_TTL", "60")))
 
 
 @app.get("/groups/{group_type}/count")
-async def get_group_recipient_count(group_type: str):
-    """Get count of recipients for a campaign type"""
+async def get_group_recipient_count(group_type: str, days: int = Query(30)):
+    """
+    Get count of recipients for a campaign type.
+    Count-only queries (no rows transferred), cached for GROUP_COUNT_TTL seconds.
+    """
     today = date.today()
+    cache_key = (group_type, days if group_type == "nudge" else None, today)
+    cached = group_count_cache.get(cache_key)
+    if cached is not None:
+        return {"count": cached, "type": group_type, "cached": True}
     
     try:
         if group_type == "birthday":
             # Contacts with DOB matching today (month and day)
-            response = db.client.table("contacts").select("id", count="exact").execute()
-            # For now return total count, filtering by DOB needs date functions
-            return {"count": len(response.data) if response.data else 0, "type": group_type}
+            count = await adb.count_contacts(db.month_day_filter("dob", today))
         
         elif group_type == "anniversary":
-            response = db.client.table("contacts").select("id", count="exact").execute()
-            return {"count": len(response.data) if response.data else 0, "type": group_type}
+            count = await adb.count_contacts(db.month_day_filter("anniversary", today))
         
-        elif group_type == "festival":
+        elif group_type in ("festival", "all"):
             # All contacts for festival messages
-            response = db.client.table("contacts").select("id", count="exact").execute()
-            return {"count": len(response.data) if response.data else 0, "type": group_type}
+            count = await adb.count_contacts()
         
         elif group_type == "nudge":
-            # Contacts inactive for 30+ days
-            response = db.client.table("contacts").select("id", count="exact").execute()
-            return {"count": len(response.data) if response.data else 0, "type": group_type}
+            # Contacts whose last visit was exactly `days` days ago
+            count = await adb.count_contacts(db.last_visit_on_filter(today - timedelta(days=days)))
         
         else:
             return {"count": 0, "type": group_type}
+        
+        group_count_cache.set(cache_key, count)
+        return {"count": count, "type": group_type}
     except Exception as e:
         print(f"Error getting count: {e}")
         return {"count": 0, "type": group_type}
@@ -701,57 +1022,19 @@ async def get_group_recipient_count(group_type: str):
 async def get_group_members(group_type: str, limit: int = 100, days: Optional[int] = Query(None)):
     """Get members of a campaign group"""
     try:
-        if group_type == "birthday":
-            # Filter in python for now
-            all_contacts = db.get_contacts_all()
-            today = date.today()
-            members = []
-            for c in all_contacts:
-                if c.get("dob"):
-                    try:
-                        dob = datetime.strptime(c["dob"], "%Y-%m-%d").date()
-                        if dob.month == today.month and dob.day == today.day:
-                            members.append(c)
-                    except:
-                        pass
-            return {"members": members, "count": len(members)}
-            
-        elif group_type == "anniversary":
-            all_contacts = db.get_contacts_all()
-            today = date.today()
-            members = []
-            for c in all_contacts:
-                if c.get("anniversary"):
-                    try:
-                        anniv = datetime.strptime(c["anniversary"], "%Y-%m-%d").date()
-                        if anniv.month == today.month and anniv.day == today.day:
-                            members.append(c)
-                    except:
-                        pass
+        if group_type in ("birthday", "anniversary"):
+            members = await adb.run(lambda: list(iter_segment_contacts(group_type)))
             return {"members": members, "count": len(members)}
         
         elif group_type == "nudge":
             if days is None:
                 return {"members": [], "count": 0, "error": "Days parameter required for nudge"}
             
-            all_contacts = db.get_contacts_all()
-            members = []
-            today = date.today()
-            for c in all_contacts:
-                if c.get("last_visit"):
-                    try:
-                        # Handle ISO format with potential Z or offset
-                        lv_str = c["last_visit"].replace("Z", "+00:00")
-                        lv = datetime.fromisoformat(lv_str).date()
-                        delta = (today - lv).days
-                        if delta == days:
-                            members.append(c)
-                    except:
-                        pass
+            members = await adb.run(lambda: list(iter_segment_contacts("nudge", nudge_days=days)))
             return {"members": members, "count": len(members)}
             
         else:
-            response = db.client.table("contacts").select("*").limit(limit).execute()
+            response = await adb.run(db.client.table("contacts").select("*").limit(limit).execute)
             return {"members": response.data or [], "count": len(response.data or [])}
     except Exception as e:
         return {"members": [], "count": 0, "error": str(e)}
@@ -767,7 +1050,7 @@ async def save_recipient_group(group: SaveGroupRequest):
             "active": True
         }
         # Insert into groups table
-        res = db.client.table("groups").insert(data).execute()
+        res = await adb.run(db.client.table("groups").insert(data).execute)
         group_id = res.data[0]["id"]
         
         # If static/manual, save members
@@ -782,15 +1065,15 @@ async def save_recipient_group(group: SaveGroupRequest):
             # Let's use 'recipient_groups' and 'group_members' from migration_v2.
             
             # Re-insert into recipient_groups instead of groups
-            res = db.client.table("recipient_groups").insert({
+            res = await adb.run(db.client.table("recipient_groups").insert({
                 "name": group.name,
                 "type": "manual"
-            }).execute()
+            }).execute)
             group_id = res.data[0]["id"]
             
             member_rows = [{"group_id": group_id, "contact_id": cid} for cid in group.member_ids]
             if member_rows:
-                db.client.table("group_members").insert(member_rows).execute()
+                await adb.run(db.client.table("group_members").insert(member_rows).execute)
                 
         return {"success": True, "id": group_id}
     except Exception as e:
@@ -806,7 +1089,7 @@ async def list_recipient_groups(type: Optional[str] = None):
         query = db.client.table("groups").select("*").eq("active", True)
         if type:
             query = query.eq("type", type)
-        res = query.order("created_at", desc=True).execute()
+        res = await adb.run(query.order("created_at", desc=True).execute)
         return {"groups": res.data or [], "count": len(res.data or [])}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -824,221 +1107,205 @@ async def send_test_message(payload: TestMessageRequest):
     return await process_and_send(msg_payload)
 
 
-@app.post("/campaigns/send")
-async def send_bulk_campaign(payload: BulkCampaignRequest):
-    """Send messages to all recipients in a group"""
-    if not META_TOKEN or not PHONE_ID:
-        raise HTTPException(status_code=500, detail="WhatsApp API not configured")
+def select_campaign_media(payload: BulkCampaignRequest) -> List[str]:
+    """Media URLs for one campaign recipient (fixed + random sample)"""
+    media_urls = []
+    if payload.media_config:
+        # Add fixed images
+        media_urls.extend(payload.media_config.fixed_urls)
+        # Add random images
+        if payload.media_config.random_pool and payload.media_config.random_count > 0:
+            # Sample without replacement if possible, else with replacement
+            count = min(payload.media_config.random_count, len(payload.media_config.random_pool))
+            media_urls.extend(random.sample(payload.media_config.random_pool, count))
+    elif payload.media_url:
+        media_urls.append(payload.media_url)
+    return media_urls
+
+
+def build_campaign_job(payload: BulkCampaignRequest, contact: dict, templates: List[MessageTemplate],
+                       now: RenderClock, builder: MessagePayloadBuilder) -> Optional[SendJob]:
+    """Build the Meta send job for one campaign recipient (None if no phone)"""
+    phone = contact.get("phone", "")
+    if not phone:
+        return None
     
+    # 1. Select Message Variation (pre-compiled) and fill placeholders
+    message = random.choice(templates).render(contact, now)
+    
+    # 2. Select Media, 3. fill the pre-built payload for this template shape
+    body = builder.build_json(to=phone, text=message, media_urls=select_campaign_media(payload))
+    return SendJob(contact=contact, payload=body)
+
+
+def campaign_media_urls(payload: BulkCampaignRequest) -> List[str]:
+    """Every image a campaign can send (fixed, random pool and single media_url)"""
+    if payload.media_config:
+        pool = payload.media_config.random_pool if payload.media_config.random_count > 0 else []
+        return payload.media_config.fixed_urls + pool
+    return [payload.media_url] if payload.media_url else []
+
+
+async def prepare_campaign_job(campaign: dict):
+    """Per-recipient job builder for a stored campaign (called once per run)"""
+    payload = BulkCampaignRequest(**(campaign.get("payload") or {}))
+    # Parse each variation once and fix "now" for [Days] for the whole run
+    templates = [compile_template(t) for t in (payload.message_variations or [payload.message_text])]
+    now = RenderClock()
+    # Upload each distinct image once; payloads then reference media ids
+    await media_registry.ensure(campaign_media_urls(payload))
+    builder = MessagePayloadBuilder(media_ref=media_registry.media_ref)
+    return lambda contact: build_campaign_job(payload, contact, templates, now, builder)
+
+
+def campaign_dispatcher() -> CampaignDispatcher:
     headers = {
         "Authorization": f"Bearer {META_TOKEN}",
         "Content-Type": "application/json"
     }
+    return CampaignDispatcher(BASE_URL, headers, client=graph.client)
+
+
+# Campaign message logs are batched: multi-row inserts + set-based contact updates
+message_log_buffer = MessageLogBuffer()
+
+# Webhook statuses are coalesced per wa_id; logs are flushed first so updates find their rows
+status_buffer = StatusBuffer(before_flush=message_log_buffer.flush)
+
+
+async def on_campaign_sent(campaign: dict, result: SendResult):
+    await message_log_buffer.add(
+        contact_id=result.contact.get("id"),
+        campaign_id=campaign["id"],
+        wa_id=result.wa_id,
+        group_name=campaign.get("campaign_type") or "campaign"
+    )
+
+
+campaign_runner = CampaignJobRunner(
+    prepare=prepare_campaign_job,
+    dispatcher_factory=campaign_dispatcher,
+    on_sent=on_campaign_sent,
+    on_checkpoint=message_log_buffer.flush
+)
+
+
+@app.on_event("startup")
+async def resume_campaign_jobs():
+    """Start write buffers and pick up campaign jobs whose owner stopped heartbeating"""
+    message_log_buffer.start()
+    status_buffer.start()
+    campaign_runner.watch()
+
+
+@app.on_event("shutdown")
+async def flush_campaign_buffers():
+    """Write anything still buffered before the process exits"""
+    await campaign_runner.close()
+    await message_log_buffer.close()
+    await status_buffer.close()
+    await graph.aclose()
+    image_optimizer.shutdown()
+
+
+@app.post("/campaigns/send")
+async def send_bulk_campaign(payload: BulkCampaignRequest):
+    """
+    Enqueue a campaign job for all recipients in a group.
+    Returns the job id immediately; poll /campaigns/{job_id}/progress.
+    """
+    if not META_TOKEN or not PHONE_ID:
+        raise HTTPException(status_code=500, detail="WhatsApp API not configured")
+    if not db.client:
+        raise HTTPException(status_code=500, detail="Database not connected")
     
-    # Get recipients
-    contacts = []
-    try:
+    # Get recipients (streamed; only the first is fetched before the job exists)
+    def iter_recipients():
         if payload.specific_recipients:
             # Fetch specific contacts
             # This is inefficient for many contacts, but fine for small batches
             for phone in payload.specific_recipients:
                 c = db.get_contact_by_phone(phone)
                 if c:
-                    contacts.append(c)
-        elif payload.type == "birthday":
-            # Re-use logic from get_group_members
-            all_c = db.get_contacts_all()
-            today = date.today()
-            for c in all_c:
-                if c.get("dob"):
-                    try:
-                        dob = datetime.strptime(c["dob"], "%Y-%m-%d").date()
-                        if dob.month == today.month and dob.day == today.day:
-                            contacts.append(c)
-                    except: pass
-        elif payload.type == "anniversary":
-            all_c = db.get_contacts_all()
-            today = date.today()
-            for c in all_c:
-                if c.get("anniversary"):
-                    try:
-                        anniv = datetime.strptime(c["anniversary"], "%Y-%m-%d").date()
-                        if anniv.month == today.month and anniv.day == today.day:
-                            contacts.append(c)
-                    except: pass
-        elif payload.type == "nudge":
-            if payload.nudge_days is not None:
-                all_c = db.get_contacts_all()
-                today = date.today()
-                for c in all_c:
-                    if c.get("last_visit"):
-                        try:
-                            lv_str = c["last_visit"].replace("Z", "+00:00")
-                            lv = datetime.fromisoformat(lv_str).date()
-                            delta = (today - lv).days
-                            if delta == payload.nudge_days:
-                                contacts.append(c)
-                        except: pass
+                    yield c
+        elif payload.type in ("birthday", "anniversary", "nudge"):
+            yield from iter_segment_contacts(payload.type, nudge_days=payload.nudge_days)
         else:
-            # Everyone
-            response = db.client.table("contacts").select("*").execute()
-            contacts = response.data or []
-            
-    except Exception as e:
-        return {"success": False, "error": f"Database error: {e}", "sent_count": 0}
+            yield from iter_segment_contacts("everyone")
     
-    if not contacts:
+    # Rows are pulled 500 at a time on the DB thread pool, so paging through a
+    # large segment never blocks the event loop
+    recipients = adb.iterate((c for c in iter_recipients() if c.get("phone")), batch_size=500)
+    try:
+        first = await recipients.__anext__()
+    except StopAsyncIteration:
         return {"success": False, "error": "No recipients found", "sent_count": 0}
+    except Exception as e:
+        return {"success": False, "error": f"Database error: {e}", "sent_count": 0}
     
-    # Create campaign record
+    # Create the job: campaign row + pending recipient rows, inserted 500 at a time
     campaign_id = None
     try:
-        campaign = db.client.table("campaigns").insert({
-            "name": f"{payload.type.title()} Campaign - {date.today()}",
-            "message_text": payload.message_text, # Base message
-            "total_recipients": len(contacts)
-        }).execute()
-        if campaign.data:
-            campaign_id = campaign.data[0]["id"]
+        campaign = await adb.create_campaign_job(
+            name=f"{payload.type.title()} Campaign - {date.today()}",
+            message_text=payload.message_text, # Base message
+            campaign_type=payload.type,
+            payload=payload.model_dump()
+        )
+        campaign_id = campaign["id"]
+        
+        total = 0
+        batch = [first]
+        async for c in recipients:
+            batch.append(c)
+            if len(batch) >= 500:
+                total += await adb.add_campaign_recipients(campaign_id, batch, start_position=total)
+                batch = []
+                # Keeps a long enqueue from being failed as abandoned
+                await campaign_runner.keep_alive(campaign_id)
+        total += await adb.add_campaign_recipients(campaign_id, batch, start_position=total)
+        # Only now can a runner (here or in another process) claim the job
+        await adb.update_campaign(campaign_id, {"total_recipients": total, "status": "queued",
+                                                "heartbeat_at": None})
     except Exception as e:
-        print(f"Failed to create campaign: {e}")
+        if campaign_id:
+            # Don't let a half-enqueued job be resumed on restart
+            try:
+                await adb.update_campaign(campaign_id, {"status": "failed"})
+            except: pass
+        return {"success": False, "error": f"Failed to create campaign: {e}", "sent_count": 0}
     
-    # Send to each recipient
-    sent_count = 0
-    failed_count = 0
+    campaign_runner.start(campaign_id)
     
-    for contact in contacts:
-        phone = contact.get("phone", "")
-        if not phone:
-            continue
-        
-        # 1. Select Message Variation
-        base_message = payload.message_text
-        if payload.message_variations:
-            base_message = random.choice(payload.message_variations)
-            
-        # Replace placeholders
-        message = replace_placeholders(base_message, contact)
-        
-        # 2. Select Media
-        media_urls = []
-        if payload.media_config:
-            # Add fixed images
-            media_urls.extend(payload.media_config.fixed_urls)
-            # Add random images
-            if payload.media_config.random_pool and payload.media_config.random_count > 0:
-                # Sample without replacement if possible, else with replacement
-                count = min(payload.media_config.random_count, len(payload.media_config.random_pool))
-                media_urls.extend(random.sample(payload.media_config.random_pool, count))
-        elif payload.media_url:
-            media_urls.append(payload.media_url)
-            
-        # 3. Send via Decision Engine logic (re-using process_and_send logic manually or calling it?)
-        # Calling process_and_send is cleaner but it expects a request object.
-        # We'll construct the payload manually to avoid overhead/async issues in loop if not careful,
-        # but actually calling the function is better for DRY.
-        
-        # Construct MessagePayload
-        msg_payload = MessagePayload(
-            recipient=phone,
-            text_content=message,
-            media_urls=media_urls,
-            template_name=None # Let decision engine decide
-        )
-        
-        # We can call the logic directly. 
-        # Since process_and_send is an async route handler, we can call it.
-        # However, it raises HTTPException on error, which we want to catch.
-        
-        try:
-            # We'll duplicate the logic slightly to avoid the HTTPException handling mess 
-            # or refactor process_and_send to a helper. 
-            # For now, let's just use the logic inline or call a helper.
-            # Let's use the logic inline for speed.
-            
-            # ... (Logic from process_and_send) ...
-            
-            # Components
-            components = []
-            if message:
-                components.append({
-                    "type": "body",
-                    "parameters": [{"type": "text", "text": message}]
-                })
-            
-            if len(media_urls) > 1:
-                template_name = "bakked_carousel_v1"
-                components.append({
-                    "type": "carousel",
-                    "cards": [
-                        {
-                            "card_index": i,
-                            "components": [{
-                                "type": "header",
-                                "parameters": [{"type": "image", "image": {"link": url}}]
-                            }]
-                        } for i, url in enumerate(media_urls[:10])
-                    ]
-                })
-            elif len(media_urls) == 1:
-                template_name = "bakked_image_cta_v1"
-                components.insert(0, {
-                    "type": "header",
-                    "parameters": [{"type": "image", "image": {"link": media_urls[0]}}]
-                })
-            else:
-                template_name = "bakked_text_v1"
-
-            final_payload = {
-                "messaging_product": "whatsapp",
-                "to": phone.replace("+", ""),
-                "type": "template",
-                "template": {
-                    "name": template_name,
-                    "language": {"code": "en_US"},
-                    "components": components
-                }
-            }
-            
-            res = requests.post(BASE_URL, headers=headers, json=final_payload, timeout=30)
-            res_data = res.json()
-            
-            if res.status_code == 200 and "messages" in res_data:
-                wa_id = res_data["messages"][0]["id"]
-                sent_count += 1
-                # Log message
-                try:
-                    db.client.table("message_logs").insert({
-                        "contact_id": contact["id"],
-                        "campaign_id": campaign_id,
-                        "wa_id": wa_id,
-                        "status": "sent"
-                    }).execute()
-                    # Update contact's last message tracking
-                    db.update_contact_last_message(contact["id"], payload.type)
-                except: pass
-            else:
-                failed_count += 1
-                print(f"Failed to send to {phone}: {res_data}")
+    return {
+        "success": True,
+        "job_id": campaign_id,
+        "status": "queued",
+        "sent_count": 0,
+        "failed_count": 0,
+        "total": total
+    }
 
-        except Exception as e:
-            failed_count += 1
-            print(f"Failed to send to {phone}: {e}")
-    
-    # Update campaign stats
-    if campaign_id:
-        try:
-            db.client.table("campaigns").update({
-                "sent_count": sent_count
-            }).eq("id", campaign_id).execute()
-        except:
-            pass
+
+@app.get("/campaigns/{campaign_id}/progress")
+async def get_campaign_progress(campaign_id: str):
+    """Progress of a campaign job: sent/failed/remaining and current throughput"""
+    live = campaign_runner.get_progress(campaign_id)
+    if live:
+        return live
     
+    campaign = await adb.get_campaign(campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    counts = await adb.count_campaign_recipients(campaign_id)
     return {
-        "success": sent_count > 0,
-        "sent_count": sent_count,
-        "failed_count": failed_count,
-        "total": len(contacts)
+        "job_id": campaign_id,
+        "status": campaign.get("status"),
+        "total": sum(counts.values()),
+        "sent_count": counts["sent"],
+        "failed_count": counts["failed"],
+        "remaining": counts["pending"] + counts["sending"],
+        "throughput": 0.0
     }
 
 
@@ -1064,7 +1331,7 @@ async def create_local_template(template: LocalTemplateRequest):
         # Convert buttons to dict list for JSON storage
         buttons_data = [btn.dict() for btn in template.buttons] if template.buttons else []
         
-        result = db.create_local_template(
+        result = await adb.create_local_template(
             name=template.name,
             message_text=template.message_text,
             category=template.category,
@@ -1080,7 +1347,7 @@ async def create_local_template(template: LocalTemplateRequest):
 @app.delete("/local-templates/{template_id}")
 async def delete_local_template(template_id: str):
     """Delete a local template"""
-    success = db.delete_local_template(template_id)
+    success = await adb.delete_local_template(template_id)
     if not success:
         raise HTTPException(status_code=404, detail="Template not found")
     return {"success": True}
@@ -1088,7 +1355,7 @@ async def delete_local_template(template_id: str):
 @app.get("/local-templates")
 async def get_local_templates(category: Optional[str] = None):
     """Get local templates with their Meta approval status"""
-    templates = db.get_local_templates(category=category)
+    templates = await adb.get_local_templates(category=category)
     return {"templates": templates, "count": len(templates)}
 
 
@@ -1115,7 +1382,7 @@ async def submit_template_to_meta(template_id: str, dry_run: bool = False):
     print(f"✓ API Version: {API_VERSION}")
     
     # Get the local template
-    template = db.get_template_by_id(template_id)
+    template = await adb.get_template_by_id(template_id)
     if not template:
         print(f"❌ Template not found: {template_id}")
         raise HTTPException(status_code=404, detail="Template not found")
@@ -1183,10 +1450,10 @@ async def submit_template_to_meta(template_id: str, dry_run: bool = False):
                 }
                 break
         
-        for i, image_url in enumerate(media_urls[:10]):  # Max 10 cards
-            print(f"  📤 Uploading image {i+1}/{num_images}...")
-            header_handle = upload_image_to_meta(image_url)
-            
+        # Uploads run in parallel; handles come back in card order
+        card_handles = await upload_images_to_meta(media_urls[:10])  # Max 10 cards
+        
+        for i, header_handle in enumerate(card_handles):
             if not header_handle:
                 print(f"  ❌ Failed to upload image {i+1}, skipping card")
                 continue
@@ -1232,7 +1499,7 @@ async def submit_template_to_meta(template_id: str, dry_run: bool = False):
             first_image_url = media_urls[0]
             print(f"📤 Uploading header image to Meta...")
             
-            header_handle = upload_image_to_meta(first_image_url)
+            header_handle = await upload_image_to_meta(first_image_url)
             
             if header_handle:
                 components.append({
@@ -1328,7 +1595,7 @@ async def submit_template_to_meta(template_id: str, dry_run: bool = False):
         url = f"https://graph.facebook.com/{API_VERSION}/{WABA_ID}/message_templates"
         print(f"\n🌐 POST {url}")
         
-        res = requests.post(url, headers=headers, json=payload, timeout=30)
+        res = await graph.post(url, headers=headers, json=payload, timeout=30)
         res_data = res.json()
         
         print(f"\n📥 RESPONSE (status {res.status_code}):")
@@ -1337,7 +1604,8 @@ async def submit_template_to_meta(template_id: str, dry_run: bool = False):
         if res.status_code == 200 and res_data.get("id"):
             # Update local template with Meta info
             print(f"\n✅ SUCCESS - Template ID: {res_data['id']}")
-            db.update_template_meta_status(
+            invalidate_template(safe_name)
+            await adb.update_template_meta_status(
                 template_id=template_id,
                 meta_template_id=res_data["id"],
                 meta_name=safe_name,
@@ -1372,50 +1640,93 @@ async def submit_template_to_meta(template_id: str, dry_run: bool = False):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+TEMPLATE_SYNC_PAGE_SIZE = int(os.getenv("TEMPLATE_SYNC_PAGE_SIZE", "100"))
+
+
+def diff_template_status(local: dict, meta_tpl: dict) -> Optional[dict]:
+    """The template id and the Meta-owned fields that changed, or None"""
+    meta_status = meta_tpl.get("status", "UNKNOWN")
+    quality_score = meta_tpl.get("quality_score", {})
+    score = quality_score.get("score") if isinstance(quality_score, dict) else None
+    
+    changes = {}
+    if local.get("meta_status") != meta_status:
+        changes["meta_status"] = meta_status
+    if score and local.get("quality_score") != score:
+        changes["quality_score"] = score
+    return {"id": local["id"], **changes} if changes else None
+
+
 @app.post("/sync-meta-templates")
 async def sync_meta_templates():
     """
     Fetch all templates from Meta and update local status.
     Call this periodically or after template submission.
+    Follows every paging cursor, then writes only the changed Meta fields
+    (one bulk update per distinct status / quality score).
     """
     if not WABA_ID or not META_TOKEN:
         raise HTTPException(status_code=500, detail="Meta API credentials not configured")
     
+    started = time.monotonic()
     headers = {"Authorization": f"Bearer {META_TOKEN}"}
-    url = f"https://graph.facebook.com/{API_VERSION}/{WABA_ID}/message_templates?fields=name,status,category,components,quality_score"
+    url = f"https://graph.facebook.com/{API_VERSION}/{WABA_ID}/message_templates"
+    params = {"fields": "name,status,category,components,quality_score", "limit": TEMPLATE_SYNC_PAGE_SIZE}
     
+    # Local state loads on the DB pool while Graph pages are fetched. Graph
+    # cursors are opaque, so pages themselves are followed one after another.
+    local_task = asyncio.create_task(adb.get_meta_linked_templates())
     try:
-        res = requests.get(url, headers=headers, timeout=30)
-        res_data = res.json()
-        
-        if "data" not in res_data:
-            return {"success": False, "error": res_data.get("error", {}).get("message", "Unknown error")}
+        meta_templates = []
+        pages = 0
+        while url:
+            res = await graph.get(url, headers=headers, params=params, timeout=30)
+            res_data = res.json()
+            
+            if "data" not in res_data:
+                local_task.cancel()
+                return {
+                    "success": False,
+                    "error": res_data.get("error", {}).get("message", "Unknown error"),
+                    "pages_fetched": pages
+                }
+            
+            pages += 1
+            meta_templates.extend(res_data["data"])
+            # paging.next already carries fields, limit and the cursor
+            url = res_data.get("paging", {}).get("next")
+            params = None
         
-        meta_templates = res_data.get("data", [])
-        updated_count = 0
+        local_by_name = {}
+        for row in await local_task:
+            local_by_name.setdefault(row.get("meta_name"), []).append(row)
         
-        # Update local templates that match Meta templates
+        # Diff local templates that match Meta templates by meta_name
+        changed = []
+        changed_names = set()
         for meta_tpl in meta_templates:
             meta_name = meta_tpl.get("name", "")
-            meta_status = meta_tpl.get("status", "UNKNOWN")
-            quality_score = meta_tpl.get("quality_score", {})
-            
-            # Find matching local template by meta_name
-            if meta_name.startswith("bakked_"):
-                updated = db.update_template_status_by_meta_name(
-                    meta_name=meta_name,
-                    meta_status=meta_status,
-                    quality_score=quality_score.get("score") if isinstance(quality_score, dict) else None
-                )
-                if updated:
-                    updated_count += 1
+            if not meta_name.startswith("bakked_"):
+                continue
+            for local in local_by_name.get(meta_name, []):
+                row = diff_template_status(local, meta_tpl)
+                if row:
+                    changed.append(row)
+                    changed_names.add(meta_name)
+        
+        updated_count = await adb.update_templates_meta_bulk(changed)
+        for name in changed_names:
+            invalidate_template(name)
         
         return {
             "success": True,
             "meta_templates_found": len(meta_templates),
-            "local_updated": updated_count
+            "pages_fetched": pages,
+            "local_updated": updated_count,
+            "elapsed_ms": round((time.monotonic() - started) * 1000)
         }
     except Exception as e:
+        local_task.cancel()
         raise HTTPException(status_code=500, detail=str(e))
 
 
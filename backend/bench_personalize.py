@@ -0,0 +1,83 @@
+"""
+Microbenchmark: compiled message rendering vs the old str.replace approach.
+
+Usage: cd backend && python bench_personalize.py [contacts]
+"""
+
+import sys
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from personalize import RenderClock, compile_template
+
+
+def legacy_replace_placeholders(text: str, contact: dict) -> str:
+    """The original app.replace_placeholders, kept here as the baseline"""
+    result = text
+    result = result.replace("[Name]", contact.get("name") or "Friend")
+    result = result.replace("[Phone]", contact.get("phone") or "")
+
+    last_visit = contact.get("last_visit")
+    if last_visit:
+        try:
+            from datetime import datetime
+            lv = datetime.fromisoformat(last_visit.replace("Z", "+00:00"))
+            days = (datetime.now(lv.tzinfo) - lv).days
+            result = result.replace("[Days]", str(days))
+        except:
+            result = result.replace("[Days]", "some")
+    else:
+        result = result.replace("[Days]", "")
+
+    return result
+
+
+VARIATIONS = [
+    "Hi [Name]! It's been [Days] days since your last visit. Come back for 20% off 🍰",
+    "Hey [Name], we miss you! Show this message at the counter ([Phone]) for a free cookie.",
+    "Happy Birthday [Name]! 🎂 Treat yourself at Bakked this week.",
+]
+
+
+def make_contacts(n: int):
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(i),
+        "name": f"Customer {i}" if i % 7 else None,
+        "phone": f"+91{9000000000 + i}",
+        "last_visit": (now - timedelta(days=random.randint(1, 90))).isoformat() if i % 5 else None,
+    } for i in range(n)]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    contacts = make_contacts(n)
+    choices = [random.choice(VARIATIONS) for _ in contacts]
+
+    # Same output check before timing
+    templates = {v: compile_template(v) for v in VARIATIONS}
+    clock = RenderClock()
+    for c, v in zip(contacts[:500], choices):
+        assert templates[v].render(c, clock) == legacy_replace_placeholders(v, c), (v, c)
+
+    def legacy():
+        for c, v in zip(contacts, choices):
+            legacy_replace_placeholders(v, c)
+
+    def compiled():
+        now = RenderClock()  # once per campaign
+        for c, v in zip(contacts, choices):
+            templates[v].render(c, now)
+
+    runs = 5
+    t_legacy = min(timeit.repeat(legacy, number=1, repeat=runs))
+    t_compiled = min(timeit.repeat(compiled, number=1, repeat=runs))
+    print(f"{n} recipients (best of {runs})")
+    print(f"  legacy str.replace : {t_legacy * 1000:8.2f} ms  ({t_legacy / n * 1e6:.2f} µs/recipient)")
+    print(f"  compiled tokens    : {t_compiled * 1000:8.2f} ms  ({t_compiled / n * 1e6:.2f} µs/recipient)")
+    print(f"  speedup            : {t_legacy / t_compiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
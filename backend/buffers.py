@@ -0,0 +1,203 @@
+"""
+Write buffers: batch Supabase writes that would otherwise cost one round trip
+per message.
+
+MessageLogBuffer collects campaign message_logs rows and contact last-message
+updates, and flushes them as multi-row inserts and set-based updates every
+N rows or T milliseconds (whichever comes first).
+
+StatusBuffer collects webhook delivery statuses, keeps only the highest status
+per wa_id, and applies them as one bulk update per status on an interval.
+
+Config (env):
+    LOG_FLUSH_ROWS     rows per flush (default 100)
+    LOG_FLUSH_MS       max time a row waits in the buffer (default 500)
+    STATUS_FLUSH_MS    webhook status flush interval (default 1000)
+"""
+
+import os
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from supabase_client import adb
+
+LOG_FLUSH_ROWS = int(os.getenv("LOG_FLUSH_ROWS", "100"))
+LOG_FLUSH_MS = int(os.getenv("LOG_FLUSH_MS", "500"))
+STATUS_FLUSH_MS = int(os.getenv("STATUS_FLUSH_MS", "1000"))
+
+# Message status progression; 'failed' only wins over pending/sent
+STATUS_RANK = {"pending": 0, "sent": 1, "failed": 2, "delivered": 3, "read": 4}
+
+
+class MessageLogBuffer:
+    """Buffers sent-message logs and contact last-message updates"""
+
+    def __init__(self, max_rows: int = LOG_FLUSH_ROWS, interval_ms: int = LOG_FLUSH_MS):
+        self.max_rows = max(1, max_rows)
+        self.interval = interval_ms / 1000
+        self._logs: List[Dict[str, Any]] = []
+        self._contacts: List[tuple] = []  # (contact_id, group_name)
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flush_count = 0
+        self.rows_written = 0
+
+    async def add(self, contact_id: Optional[str], campaign_id: Optional[str], wa_id: str,
+                  group_name: Optional[str] = None):
+        """Queue one sent message; flushes when the buffer reaches max_rows"""
+        self._logs.append({
+            "contact_id": contact_id,
+            "campaign_id": campaign_id,
+            "wa_id": wa_id,
+            "status": "sent",
+            "sent_at": datetime.now(timezone.utc).isoformat()
+        })
+        if contact_id and group_name:
+            self._contacts.append((contact_id, group_name))
+        if len(self._logs) >= self.max_rows:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write everything buffered so far, returns log rows written"""
+        async with self._lock:
+            logs, self._logs = self._logs, []
+            contacts, self._contacts = self._contacts, []
+            if not logs and not contacts:
+                return 0
+            try:
+                await adb.create_message_logs_bulk(logs)
+            except Exception as e:
+                # Keep the rows for the next flush rather than dropping them
+                print(f"⚠️ Message log flush failed ({len(logs)} rows), will retry: {e}")
+                self._logs[:0] = logs
+                self._contacts[:0] = contacts
+                return 0
+
+            sent_at = logs[-1]["sent_at"]
+            by_group: Dict[str, List[str]] = defaultdict(list)
+            for contact_id, group_name in contacts:
+                by_group[group_name].append(contact_id)
+            for group_name, contact_ids in by_group.items():
+                try:
+                    await adb.update_contacts_last_message_bulk(list(dict.fromkeys(contact_ids)), group_name, sent_at)
+                except Exception as e:
+                    print(f"⚠️ Contact last-message update failed: {e}")
+
+            self.flush_count += 1
+            self.rows_written += len(logs)
+            return len(logs)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Message log buffer error: {e}")
+
+    def start(self):
+        """Start the time-based flush loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stop the flush loop and write anything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class StatusBuffer:
+    """Coalesces webhook status updates per wa_id and applies them in bulk"""
+
+    def __init__(self, interval_ms: int = STATUS_FLUSH_MS,
+                 before_flush: Optional[Callable[[], Awaitable[Any]]] = None):
+        """
+        before_flush: awaited before each flush, e.g. to write buffered
+            message_logs so status updates have rows to land on
+        """
+        self.interval = interval_ms / 1000
+        self.before_flush = before_flush
+        self._pending: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.applied = 0
+        self.skipped = 0
+
+    def add(self, wa_id: str, status: str):
+        """Queue a status, keeping only the highest one seen for the message"""
+        self.received += 1
+        if not STATUS_RANK.get(status):
+            # Unknown (or 'pending'): no rank to guard the update with, so
+            # applying it could move a 'read' message backwards
+            self.skipped += 1
+            return
+        current = self._pending.get(wa_id)
+        if current is None or STATUS_RANK[status] > STATUS_RANK[current]:
+            self._pending[wa_id] = status
+
+    async def flush(self) -> int:
+        """Apply buffered statuses as one bulk update per status, returns messages updated"""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            if self.before_flush:
+                try:
+                    await self.before_flush()
+                except Exception as e:
+                    print(f"⚠️ Pre-flush hook failed: {e}")
+
+            pending, self._pending = self._pending, {}
+            by_status: Dict[str, List[str]] = defaultdict(list)
+            for wa_id, status in pending.items():
+                by_status[status].append(wa_id)
+
+            applied = 0
+            for status, wa_ids in by_status.items():
+                # Never move a message backwards (e.g. 'delivered' after 'read');
+                # add() only queues ranked statuses, so this is never empty
+                lower = [s for s, r in STATUS_RANK.items() if r < STATUS_RANK[status]]
+                try:
+                    await adb.update_message_status_bulk(wa_ids, status, lower)
+                    applied += len(wa_ids)
+                except Exception as e:
+                    print(f"⚠️ Status flush failed for {len(wa_ids)} '{status}' updates, will retry: {e}")
+                    for wa_id in wa_ids:
+                        self.add(wa_id, status)
+                        self.received -= 1
+            self.applied += applied
+            if applied:
+                print(f"📨 Applied {applied} status updates ({len(by_status)} bulk writes)")
+            return applied
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Status buffer error: {e}")
+
+    def start(self):
+        """Start the interval flush loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stop the flush loop and apply anything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,354 @@
+"""
+Campaign Jobs: durable background campaign sends.
+
+`/campaigns/send` stores the request and its recipients (campaign_recipients)
+against a `campaigns` row, then hands the campaign id to the runner here.
+The runner sends recipients in chunks and checkpoints each chunk's outcome,
+so a job interrupted by a restart is resumed on startup from its pending
+recipients instead of starting over.
+
+Sends are at most once: a chunk's rows are moved from 'pending' to 'sending'
+before dispatch, and only 'pending' rows are ever picked up. If the checkpoint
+write fails, the chunk's outcomes stay in memory and only the write is
+retried. Rows a crash leaves in 'sending' are marked failed, not re-sent.
+
+Several processes may run at once (rolling deploys, extra workers). A process
+only runs a job after claiming it: a conditional update that succeeds only
+while the job's heartbeat_at is unset or older than CAMPAIGN_JOB_STALE_SECONDS.
+The owner refreshes heartbeat_at while it works, and every process re-checks
+for stale jobs on that interval, so a job whose owner died is taken over.
+Even if two owners overlap, recipient rows are claimed one chunk at a time,
+so no recipient is sent twice.
+
+A job that errors (e.g. Supabase briefly unreachable) is retried with
+exponential backoff; after CAMPAIGN_JOB_RETRIES failed attempts it is marked
+'failed' in the DB, leaving its pending recipients untouched.
+
+Config (env):
+    CAMPAIGN_CHUNK_SIZE         recipients per checkpointed chunk (default 200)
+    CAMPAIGN_JOB_RETRIES        retries after a job error (default 3)
+    CAMPAIGN_JOB_RETRY_SECONDS  first retry delay, doubled each time (default 30)
+    CAMPAIGN_JOB_STALE_SECONDS  heartbeat age after which a job can be taken over (default 120)
+"""
+
+import os
+import time
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dispatcher import CampaignDispatcher, SendJob, SendResult
+from supabase_client import adb
+
+CAMPAIGN_CHUNK_SIZE = int(os.getenv("CAMPAIGN_CHUNK_SIZE", "200"))
+CAMPAIGN_JOB_RETRIES = int(os.getenv("CAMPAIGN_JOB_RETRIES", "3"))
+CAMPAIGN_JOB_RETRY_SECONDS = float(os.getenv("CAMPAIGN_JOB_RETRY_SECONDS", "30"))
+CAMPAIGN_JOB_STALE_SECONDS = float(os.getenv("CAMPAIGN_JOB_STALE_SECONDS", "120"))
+
+# Builds the SendJob for one recipient contact (None = cannot be sent)
+JobBuilder = Callable[[Dict[str, Any]], Optional[SendJob]]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _stale_before() -> str:
+    """Heartbeats older than this belong to a dead (or stuck) process"""
+    return (datetime.now(timezone.utc) - timedelta(seconds=CAMPAIGN_JOB_STALE_SECONDS)).isoformat()
+
+
+@dataclass
+class JobProgress:
+    """Live progress of a running campaign job"""
+    campaign_id: str
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    status: str = "queued"
+    handled_this_run: int = 0
+    run_started: float = field(default_factory=time.monotonic)
+    # Outcomes of a sent chunk whose checkpoint write hasn't succeeded yet
+    unsaved: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def remaining(self) -> int:
+        return max(self.total - self.sent - self.failed, 0)
+
+    @property
+    def throughput(self) -> float:
+        """Messages handled per second since this worker picked the job up"""
+        elapsed = time.monotonic() - self.run_started
+        return self.handled_this_run / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.campaign_id,
+            "status": self.status,
+            "total": self.total,
+            "sent_count": self.sent,
+            "failed_count": self.failed,
+            "remaining": self.remaining,
+            "throughput": round(self.throughput, 2)
+        }
+
+
+class CampaignJobRunner:
+    """Runs campaign jobs as background tasks with chunked checkpoints"""
+
+    def __init__(self,
+                 prepare: Callable[[Dict[str, Any]], Awaitable[JobBuilder]],
+                 dispatcher_factory: Callable[[], CampaignDispatcher],
+                 on_sent: Optional[Callable[[Dict[str, Any], SendResult], Awaitable[None]]] = None,
+                 on_checkpoint: Optional[Callable[[], Awaitable[Any]]] = None,
+                 chunk_size: int = CAMPAIGN_CHUNK_SIZE):
+        """
+        prepare: awaited once per run with the campaign row, returns the
+            per-recipient JobBuilder (e.g. after uploading campaign media)
+        dispatcher_factory: returns the dispatcher used for sends
+        on_sent: awaited for every successful send (message logging)
+        on_checkpoint: awaited before each chunk is checkpointed, so buffered
+            writes for the chunk land before it is marked done
+        """
+        self.prepare = prepare
+        self.dispatcher_factory = dispatcher_factory
+        self.on_sent = on_sent
+        self.on_checkpoint = on_checkpoint
+        self.chunk_size = chunk_size
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._progress: Dict[str, JobProgress] = {}
+        self._beats: Dict[str, float] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def start(self, campaign_id: str) -> bool:
+        """Start a job in the background, returns False if already running here
+        (the job itself exits early if another process owns it)"""
+        task = self._tasks.get(campaign_id)
+        if task and not task.done():
+            return False
+        self._tasks[campaign_id] = asyncio.create_task(self._run(campaign_id))
+        return True
+
+    async def resume_unfinished(self) -> int:
+        """Restart queued/running jobs whose owner stopped heartbeating"""
+        stale_before = _stale_before()
+        try:
+            # Jobs whose enqueue stopped heartbeating have a partial
+            # recipient list: never send those
+            abandoned = await adb.fail_abandoned_campaign_jobs(stale_before)
+            if abandoned:
+                print(f"⚠️ Marked {abandoned} half-enqueued campaign job(s) as failed")
+            rows = await adb.get_unfinished_campaigns(stale_before)
+        except Exception as e:
+            print(f"⚠️ Could not load unfinished campaigns: {e}")
+            return 0
+        resumed = 0
+        for row in rows:
+            if self.start(row["id"]):
+                print(f"🔁 Resuming campaign job {row['id']} ({row.get('status')})")
+                resumed += 1
+        return resumed
+
+    async def _watch(self):
+        while True:
+            await self.resume_unfinished()
+            await asyncio.sleep(CAMPAIGN_JOB_STALE_SECONDS)
+
+    def watch(self):
+        """Resume unfinished jobs now, then keep taking over jobs whose owner died"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        """Stop watching for stale jobs"""
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def keep_alive(self, campaign_id: str):
+        """Refresh the job's heartbeat_at, at most every quarter stale interval"""
+        now = time.monotonic()
+        if now - self._beats.get(campaign_id, 0.0) < CAMPAIGN_JOB_STALE_SECONDS / 4:
+            return
+        self._beats[campaign_id] = now
+        await adb.update_campaign(campaign_id, {"heartbeat_at": _now()})
+
+    async def _heartbeat(self, campaign_id: str):
+        while True:
+            await asyncio.sleep(CAMPAIGN_JOB_STALE_SECONDS / 4)
+            try:
+                await self.keep_alive(campaign_id)
+            except Exception as e:
+                print(f"⚠️ Campaign job {campaign_id} heartbeat failed: {e}")
+
+    def get_progress(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """Live progress for a job run by this process, if any"""
+        progress = self._progress.get(campaign_id)
+        return progress.to_dict() if progress else None
+
+    async def _run(self, campaign_id: str):
+        try:
+            claimed = await adb.claim_campaign_job(campaign_id, _stale_before())
+        except Exception as e:
+            print(f"⚠️ Could not claim campaign job {campaign_id}: {e}")
+            claimed = False
+        if not claimed:
+            # Finished, or another process is heartbeating it
+            self._beats.pop(campaign_id, None)
+            self._tasks.pop(campaign_id, None)
+            return
+        self._beats[campaign_id] = time.monotonic()
+        heartbeat = asyncio.create_task(self._heartbeat(campaign_id))
+        progress = JobProgress(campaign_id=campaign_id)
+        self._progress[campaign_id] = progress
+        attempt = 0
+        try:
+            while True:
+                try:
+                    await self._run_once(campaign_id, progress)
+                    return
+                except asyncio.CancelledError:
+                    # Shutdown: leave status as 'running'; another process takes
+                    # it over once the heartbeat goes stale
+                    print(f"⏸️ Campaign job {campaign_id} interrupted, will be resumed")
+                    raise
+                except Exception as e:
+                    attempt += 1
+                    if attempt > CAMPAIGN_JOB_RETRIES:
+                        print(f"❌ Campaign job {campaign_id} failed after {attempt} attempts: {e}")
+                        await self._mark_failed(campaign_id, progress)
+                        return
+                    delay = CAMPAIGN_JOB_RETRY_SECONDS * 2 ** (attempt - 1)
+                    progress.status = "retrying"
+                    print(f"⚠️ Campaign job {campaign_id} error: {e} - retrying in {delay:.0f}s")
+                    await asyncio.sleep(delay)
+        finally:
+            heartbeat.cancel()
+            self._beats.pop(campaign_id, None)
+            self._tasks.pop(campaign_id, None)
+
+    async def _mark_failed(self, campaign_id: str, progress: JobProgress):
+        """Terminal status, so neither /progress nor a restart treats the job as live"""
+        progress.status = "failed"
+        if progress.unsaved:
+            print(f"⚠️ Campaign job {campaign_id}: {len(progress.unsaved)} sent outcomes could not be saved")
+        try:
+            await adb.update_campaign(campaign_id, {
+                "status": "failed",
+                "sent_count": progress.sent,
+                "failed_count": progress.failed,
+                "finished_at": _now()
+            })
+        except Exception as e:
+            # Still 'running' in the DB: it is resumed once the heartbeat goes stale
+            print(f"⚠️ Could not mark campaign job {campaign_id} failed: {e}")
+
+    async def _run_once(self, campaign_id: str, progress: JobProgress):
+        """One attempt at a job: resume from its pending recipients until none are left"""
+        progress.run_started = time.monotonic()
+        progress.handled_this_run = 0
+        campaign = await adb.get_campaign(campaign_id)
+        if not campaign:
+            print(f"❌ Campaign job {campaign_id} not found")
+            progress.status = "failed"
+            return
+
+        # A previous attempt sent a chunk but couldn't record it: save, don't resend
+        if progress.unsaved:
+            await self._save_checkpoint(campaign, progress)
+        interrupted = await adb.fail_interrupted_campaign_recipients(campaign_id)
+        if interrupted:
+            print(f"⚠️ Campaign job {campaign_id}: {interrupted} interrupted sends marked failed")
+
+        # Counts come from the recipient rows, the source of truth after a crash
+        counts = await adb.count_campaign_recipients(campaign_id)
+        progress.sent = counts["sent"]
+        progress.failed = counts["failed"]
+        progress.total = sum(counts.values())
+        progress.status = "running"
+
+        started = {"status": "running", "heartbeat_at": _now()}
+        if not campaign.get("started_at"):
+            started["started_at"] = started["heartbeat_at"]
+        await adb.update_campaign(campaign_id, started)
+
+        build_job = await self.prepare(campaign)
+        dispatcher = self.dispatcher_factory()
+
+        while True:
+            chunk = await adb.get_pending_campaign_recipients(campaign_id, self.chunk_size)
+            if not chunk:
+                break
+            await self._process_chunk(campaign, chunk, build_job, dispatcher, progress)
+
+        progress.status = "completed"
+        await adb.update_campaign(campaign_id, {
+            "status": "completed",
+            "sent_count": progress.sent,
+            "failed_count": progress.failed,
+            "finished_at": _now()
+        })
+        print(f"✅ Campaign job {campaign_id} done: {progress.sent} sent, {progress.failed} failed")
+
+    async def _process_chunk(self, campaign: Dict[str, Any], chunk, build_job: JobBuilder,
+                             dispatcher: CampaignDispatcher, progress: JobProgress):
+        """Claim one chunk, send it and checkpoint every recipient's outcome"""
+        chunk = await adb.claim_campaign_recipients(campaign["id"], chunk[0]["position"], chunk[-1]["position"])
+        outcomes: Dict[str, SendResult] = {}
+        jobs = []
+        for row in chunk:
+            job = build_job(row.get("contact") or {"id": row.get("contact_id"), "phone": row["phone"]})
+            if job is None:
+                outcomes[row["id"]] = SendResult(contact=row, success=False, error="No phone number", key=row["id"])
+                continue
+            job.key = row["id"]
+            jobs.append(job)
+
+        async def on_result(result: SendResult):
+            outcomes[result.key] = result
+            if result.success and self.on_sent:
+                await self.on_sent(campaign, result)
+
+        await dispatcher.dispatch(jobs, on_result=on_result)
+
+        updated_at = _now()
+        rows = []
+        for row in chunk:
+            result = outcomes.get(row["id"])
+            if result is None:
+                continue
+            rows.append({
+                "id": row["id"],
+                "campaign_id": row["campaign_id"],
+                "position": row["position"],
+                "phone": row["phone"],
+                "status": "sent" if result.success else "failed",
+                "wa_id": result.wa_id,
+                "error": result.error,
+                "updated_at": updated_at
+            })
+            if result.success:
+                progress.sent += 1
+            else:
+                progress.failed += 1
+            progress.handled_this_run += 1
+
+        progress.unsaved = rows
+        await self._save_checkpoint(campaign, progress)
+
+    async def _save_checkpoint(self, campaign: Dict[str, Any], progress: JobProgress):
+        """Write the last chunk's outcomes (kept in progress.unsaved until this succeeds)"""
+        if self.on_checkpoint:
+            await self.on_checkpoint()
+        await adb.checkpoint_campaign_recipients(progress.unsaved)
+        progress.unsaved = []
+        await adb.update_campaign(campaign["id"], {
+            "sent_count": progress.sent,
+            "failed_count": progress.failed,
+            "heartbeat_at": _now()
+        })
@@ -0,0 +1,185 @@
+"""
+Bulk contact import: parse a CSV / XLSX export row by row into clean
+contacts rows, ready for batched upserts on phone.
+
+Rows are read lazily (csv module over the spooled upload, openpyxl in
+read-only mode), so a 50k-row POS export is never held in memory. Each row
+becomes either a contacts row or a per-row error.
+
+Recognized columns (case-insensitive, spaces/underscores ignored):
+    phone        phone, mobile, mobile number, phone number, contact, whatsapp
+    name         name, customer name, full name, customer
+    dob          dob, birthday, date of birth, birth date
+    anniversary  anniversary, anniversary date
+    last_visit   last visit, last visit date, last order
+    tags         tags (comma or semicolon separated)
+
+openpyxl (pinned in requirements.txt) reads .xlsx files.
+
+Config (env):
+    IMPORT_DEFAULT_COUNTRY_CODE  prefix for 10-digit local numbers (default 91)
+"""
+
+import os
+import io
+import csv
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+IMPORT_DEFAULT_COUNTRY_CODE = os.getenv("IMPORT_DEFAULT_COUNTRY_CODE", "91")
+
+COLUMN_ALIASES = {
+    "phone": {"phone", "mobile", "mobilenumber", "mobileno", "phonenumber", "phoneno", "contact", "whatsapp"},
+    "name": {"name", "customername", "fullname", "customer"},
+    "dob": {"dob", "birthday", "dateofbirth", "birthdate"},
+    "anniversary": {"anniversary", "anniversarydate"},
+    "last_visit": {"lastvisit", "lastvisitdate", "lastorder"},
+    "tags": {"tags"},
+}
+
+# Day-first, as POS exports here write dates
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d %b %Y", "%d %B %Y", "%d-%b-%Y")
+
+
+class ImportFormatError(ValueError):
+    """The file itself can't be imported (bad type, no phone column, ...)"""
+
+
+@dataclass
+class ParsedRow:
+    row: int                            # spreadsheet row number (header is row 1)
+    contact: Optional[Dict[str, Any]] = None
+    raw_phone: Optional[str] = None
+    errors: List[str] = field(default_factory=list)
+
+
+def _key(header: Any) -> str:
+    return re.sub(r"[\s_\-.]+", "", str(header or "")).lower()
+
+
+def map_columns(headers: List[Any]) -> Dict[int, str]:
+    """Column index -> contacts field, for the headers we recognize"""
+    mapping = {}
+    for i, header in enumerate(headers):
+        k = _key(header)
+        for column, aliases in COLUMN_ALIASES.items():
+            if k in aliases and column not in mapping.values():
+                mapping[i] = column
+    if "phone" not in mapping.values():
+        raise ImportFormatError("No phone column found (expected e.g. 'phone' or 'mobile')")
+    return mapping
+
+
+def normalize_phone(value: Any, country_code: str = IMPORT_DEFAULT_COUNTRY_CODE) -> str:
+    """E.164 phone (+919876543210) from the usual POS / Excel spellings"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # Excel stores numbers as floats
+    text = str(value or "").strip()
+    if text.endswith(".0"):
+        text = text[:-2]
+    digits = re.sub(r"\D", "", text)
+    if text.startswith("+"):
+        pass
+    elif text.startswith("00"):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith("0"):
+        digits = country_code + digits[1:]
+    elif len(digits) == 10:
+        digits = country_code + digits
+    if not 10 <= len(digits) <= 15:
+        raise ValueError(f"invalid phone '{text}'")
+    return "+" + digits
+
+
+def parse_date(value: Any) -> str:
+    """ISO date (YYYY-MM-DD) from a date cell or a day-first date string"""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"invalid date '{text}'")
+
+
+def parse_timestamp(value: Any) -> str:
+    """ISO timestamp for last_visit (date-only values become midnight)"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    try:
+        return datetime.fromisoformat(str(value).strip().replace("Z", "+00:00")).isoformat()
+    except ValueError:
+        return parse_date(value) + "T00:00:00"
+
+
+def parse_row(row_number: int, values: Tuple[Any, ...], mapping: Dict[int, str]) -> ParsedRow:
+    """One spreadsheet row -> contacts row (blank cells are left out, not nulled)"""
+    parsed = ParsedRow(row=row_number)
+    contact: Dict[str, Any] = {}
+    for i, column in mapping.items():
+        value = values[i] if i < len(values) else None
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+        try:
+            if column == "phone":
+                parsed.raw_phone = str(value).strip()
+                contact["phone"] = normalize_phone(value)
+            elif column in ("dob", "anniversary"):
+                contact[column] = parse_date(value)
+            elif column == "last_visit":
+                contact[column] = parse_timestamp(value)
+            elif column == "tags":
+                contact["tags"] = [t.strip() for t in re.split(r"[,;]", str(value)) if t.strip()]
+            else:
+                contact[column] = str(value).strip()
+        except ValueError as e:
+            parsed.errors.append(f"{column}: {e}")
+    if "phone" not in contact and not any(e.startswith("phone") for e in parsed.errors):
+        parsed.errors.append("phone: missing")
+    if not parsed.errors:
+        parsed.contact = contact
+    return parsed
+
+
+def _csv_rows(file_obj: BinaryIO) -> Iterator[Tuple[Any, ...]]:
+    text = io.TextIOWrapper(file_obj, encoding="utf-8-sig", errors="replace", newline="")
+    for values in csv.reader(text):
+        yield tuple(values)
+
+
+def _xlsx_rows(file_obj: BinaryIO) -> Iterator[Tuple[Any, ...]]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFormatError("XLSX import needs openpyxl (pip install openpyxl); upload a CSV instead")
+    workbook = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        for values in workbook.worksheets[0].iter_rows(values_only=True):
+            yield values
+    finally:
+        workbook.close()
+
+
+def iter_import_rows(file_obj: BinaryIO, filename: str) -> Iterator[ParsedRow]:
+    """Parsed rows of a CSV / XLSX file, skipping empty lines"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        rows = _xlsx_rows(file_obj)
+    elif filename.lower().endswith((".csv", ".txt")):
+        rows = _csv_rows(file_obj)
+    else:
+        raise ImportFormatError("Upload a .csv or .xlsx file")
+
+    headers = next(rows, None)
+    if headers is None:
+        raise ImportFormatError("File is empty")
+    mapping = map_columns(list(headers))
+    for row_number, values in enumerate(rows, start=2):
+        if not any(v not in (None, "") for v in values):
+            continue
+        yield parse_row(row_number, values, mapping)
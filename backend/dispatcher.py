@@ -0,0 +1,184 @@
+"""
+Campaign Dispatcher: concurrent, rate-aware WhatsApp sends.
+
+Runs many Graph API message sends at once over async HTTP, bounded by a
+concurrency limit and a messages-per-second cap.
+
+Config (env):
+    CAMPAIGN_CONCURRENCY   max in-flight sends (default 20)
+    CAMPAIGN_MAX_MPS       max sends started per second (default 50, 0 = no cap)
+    CAMPAIGN_MAX_RETRIES   retries for Meta throttling / connection failures (default 3)
+
+/messages is not idempotent, so a send is only retried when the request
+provably never reached Meta (connect / pool errors) or Meta asked us to slow
+down. Timeouts, dropped connections and 5xx may come after Meta accepted the
+message; retrying those could message the customer twice, so they fail.
+"""
+
+import os
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+import httpx
+
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "20"))
+CAMPAIGN_MAX_MPS = float(os.getenv("CAMPAIGN_MAX_MPS", "50"))
+CAMPAIGN_MAX_RETRIES = int(os.getenv("CAMPAIGN_MAX_RETRIES", "3"))
+
+# Meta error codes that mean "slow down" rather than "this message is bad"
+THROTTLE_ERROR_CODES = {4, 80007, 130429, 131048, 131056}
+
+# Transport errors raised before any request bytes were sent
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RateLimiter:
+    """Spaces out acquisitions so no more than `rate` happen per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@dataclass
+class SendJob:
+    """One message to send: the recipient contact and the Meta payload (dict or pre-serialized JSON)"""
+    contact: Dict[str, Any]
+    payload: Union[Dict[str, Any], bytes]
+    key: Optional[str] = None  # Caller's handle for matching results (e.g. recipient row id)
+
+
+@dataclass
+class SendResult:
+    """Outcome of a single send"""
+    contact: Dict[str, Any]
+    success: bool
+    wa_id: Optional[str] = None
+    error: Optional[str] = None
+    key: Optional[str] = None
+
+
+@dataclass
+class DispatchResult:
+    """Totals for a dispatch run"""
+    sent_count: int = 0
+    failed_count: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Messages handled per second"""
+        total = self.sent_count + self.failed_count
+        return total / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class CampaignDispatcher:
+    """Sends SendJobs to the Graph API with bounded concurrency and a rate cap"""
+
+    def __init__(self, url: str, headers: Dict[str, str],
+                 concurrency: int = CAMPAIGN_CONCURRENCY,
+                 max_mps: float = CAMPAIGN_MAX_MPS,
+                 max_retries: int = CAMPAIGN_MAX_RETRIES,
+                 timeout: float = 30,
+                 client: Optional[httpx.AsyncClient] = None):
+        """client: shared pooled client; without one, each dispatch opens its own"""
+        self.url = url
+        self.client = client
+        self.headers = headers
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = RateLimiter(max_mps)
+
+    async def send_one(self, client: httpx.AsyncClient, job: SendJob) -> SendResult:
+        """Send one message, retrying only when it can't have been delivered (see module doc)"""
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                if isinstance(job.payload, bytes):
+                    res = await client.post(self.url, headers=self.headers, content=job.payload, timeout=self.timeout)
+                else:
+                    res = await client.post(self.url, headers=self.headers, json=job.payload, timeout=self.timeout)
+            except NOT_SENT_ERRORS as e:
+                if attempt < self.max_retries:
+                    attempt += 1
+                    await asyncio.sleep(2 ** attempt * 0.5)
+                    continue
+                return SendResult(contact=job.contact, success=False, error=str(e), key=job.key)
+            except httpx.HTTPError as e:
+                # May have reached Meta: don't risk a duplicate message
+                return SendResult(contact=job.contact, success=False, error=str(e) or type(e).__name__, key=job.key)
+
+            try:
+                res_data = res.json()
+            except ValueError:
+                res_data = {}
+
+            if res.status_code == 200 and "messages" in res_data:
+                return SendResult(contact=job.contact, success=True, wa_id=res_data["messages"][0]["id"], key=job.key)
+
+            error = res_data.get("error", {}) if isinstance(res_data, dict) else {}
+            retryable = res.status_code == 429 or error.get("code") in THROTTLE_ERROR_CODES
+            if retryable and attempt < self.max_retries:
+                attempt += 1
+                await asyncio.sleep(2 ** attempt * 0.5)
+                continue
+            return SendResult(contact=job.contact, success=False,
+                              error=error.get("message") or str(res_data) or f"HTTP {res.status_code}", key=job.key)
+
+    async def dispatch(self, jobs: Iterable[SendJob],
+                       on_result: Optional[Callable[[SendResult], Awaitable[None]]] = None,
+                       client: Optional[httpx.AsyncClient] = None) -> DispatchResult:
+        """
+        Send every job and return the totals.
+
+        Jobs are pulled lazily by a fixed pool of workers, so `jobs` can be a
+        generator and only `concurrency` payloads are held at once.
+        `on_result` is awaited for every finished send (success or failure).
+        """
+        result = DispatchResult()
+        job_iter = iter(jobs)
+        started = time.monotonic()
+
+        async def worker(http: httpx.AsyncClient):
+            for job in job_iter:
+                outcome = await self.send_one(http, job)
+                if outcome.success:
+                    result.sent_count += 1
+                else:
+                    result.failed_count += 1
+                    print(f"Failed to send to {job.contact.get('phone')}: {outcome.error}")
+                if on_result:
+                    try:
+                        await on_result(outcome)
+                    except Exception as e:
+                        print(f"⚠️ Result handler error: {e}")
+
+        async def run(http: httpx.AsyncClient):
+            await asyncio.gather(*(worker(http) for _ in range(self.concurrency)))
+
+        client = client or self.client
+        if client is not None:
+            await run(client)
+        else:
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            async with httpx.AsyncClient(limits=limits) as http:
+                await run(http)
+
+        result.elapsed = time.monotonic() - started
+        return result
@@ -0,0 +1,124 @@
+"""
+Graph Client: one pooled, keep-alive HTTP client for all Meta Graph API
+traffic (messages, templates, uploads) and media downloads.
+
+Reusing connections saves a TCP + TLS handshake to graph.facebook.com on
+every call. HTTP/2 is optional (needs the `h2` package) and multiplexes
+concurrent campaign sends over a single connection.
+
+Config (env):
+    GRAPH_POOL_SIZE        max open connections (default 50)
+    GRAPH_KEEPALIVE        idle connections kept for reuse (default 20)
+    GRAPH_KEEPALIVE_EXPIRY seconds an idle connection is kept (default 60)
+    GRAPH_HTTP2            1 to enable HTTP/2 (default 0)
+    GRAPH_TIMEOUT          default per-call timeout in seconds (default 30)
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "50"))
+GRAPH_KEEPALIVE = int(os.getenv("GRAPH_KEEPALIVE", "20"))
+GRAPH_KEEPALIVE_EXPIRY = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", "60"))
+GRAPH_HTTP2 = os.getenv("GRAPH_HTTP2", "0") == "1"
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "30"))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class GraphClient:
+    """Shared httpx.AsyncClient with connection reuse stats"""
+
+    def __init__(self, pool_size: int = GRAPH_POOL_SIZE, keepalive: int = GRAPH_KEEPALIVE,
+                 keepalive_expiry: float = GRAPH_KEEPALIVE_EXPIRY, http2: bool = GRAPH_HTTP2,
+                 timeout: float = GRAPH_TIMEOUT):
+        if http2 and not _http2_available():
+            print("⚠️ GRAPH_HTTP2=1 but 'h2' is not installed - using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.connections_opened = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled client (created lazily inside the running event loop)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+                event_hooks={"request": [self._track]}
+            )
+        return self._client
+
+    async def _track(self, request: httpx.Request):
+        # httpcore reports each new TCP connection through the trace extension;
+        # requests that never trigger one went over a reused connection
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event: str, info: Dict[str, Any]):
+        if event == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def request(self, method: str, url: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """Send a request; timeout overrides the default for this call only"""
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return await self.client.request(method, url, **kwargs)
+
+    def stream(self, method: str, url: str, timeout: Optional[float] = None, **kwargs):
+        """Streaming request (async context manager); the body is read with aiter_bytes()"""
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return self.client.stream(method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool configuration and connection reuse counters"""
+        connections = self.connections_opened
+        open_connections = None
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        if pool is not None:
+            open_connections = len(getattr(pool, "connections", []))
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "requests": self.requests,
+            "connections_opened": connections,
+            "open_connections": open_connections,
+            "reuse_rate": round(1 - connections / self.requests, 3) if self.requests else 0.0
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Singleton instance
+graph = GraphClient()
@@ -0,0 +1,89 @@
+"""
+Header handle cache: remembers Meta resumable-upload handles per image so a
+template that reuses a product photo doesn't download and re-upload it.
+
+Lookups are content-addressed (SHA-256 of the image bytes). The storage URL
+plus its ETag is a second key, checked with a cheap HEAD request, that lets a
+repeat submission skip the download too. Rows live in meta_header_handles
+(migration v10); if the table is missing the cache just misses.
+
+Config (env):
+    HEADER_HANDLE_TTL_HOURS  how long a handle is reused (default 168)
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from supabase_client import adb
+
+HEADER_HANDLE_TTL_HOURS = float(os.getenv("HEADER_HANDLE_TTL_HOURS", "168"))
+
+
+class HeaderHandleCache:
+    """Persistent image -> header_handle map with hit/miss counters"""
+
+    def __init__(self, ttl_hours: float = HEADER_HANDLE_TTL_HOURS):
+        self.ttl = timedelta(hours=ttl_hours)
+        self.url_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def _lookup(self, **key) -> Optional[str]:
+        try:
+            row = await adb.get_header_handle(**key)
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Header handle cache lookup failed: {e}")
+            return None
+        return row["header_handle"] if row else None
+
+    async def get_by_url(self, source_url: str, etag: Optional[str]) -> Optional[str]:
+        """Handle for an unchanged storage object (no download needed)"""
+        if not etag:
+            return None
+        handle = await self._lookup(source_url=source_url, etag=etag)
+        if handle:
+            self.url_hits += 1
+        return handle
+
+    async def get_by_hash(self, sha256: str) -> Optional[str]:
+        """Handle for identical image bytes, wherever they were uploaded from"""
+        handle = await self._lookup(sha256=sha256)
+        if handle:
+            self.hash_hits += 1
+        else:
+            self.misses += 1
+        return handle
+
+    async def put(self, sha256: str, header_handle: str, source_url: Optional[str] = None,
+                  etag: Optional[str] = None, file_size: Optional[int] = None,
+                  content_type: Optional[str] = None):
+        row = {
+            "sha256": sha256,
+            "source_url": source_url,
+            "etag": etag,
+            "header_handle": header_handle,
+            "file_size": file_size,
+            "content_type": content_type,
+            "expires_at": (datetime.now(timezone.utc) + self.ttl).isoformat()
+        }
+        try:
+            await adb.save_header_handle(row)
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Header handle cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.url_hits + self.hash_hits
+        total = hits + self.misses
+        return {
+            "ttl_hours": self.ttl.total_seconds() / 3600,
+            "hits": hits,
+            "url_hits": self.url_hits,
+            "hash_hits": self.hash_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(hits / total, 3) if total else 0.0
+        }
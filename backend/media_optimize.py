@@ -0,0 +1,146 @@
+"""
+Image optimization for uploaded campaign media.
+
+Phone photos are often several MB and far larger than WhatsApp displays.
+Before storage, images are downscaled so the long edge fits
+MEDIA_MAX_DIMENSION, EXIF-rotated, stripped of metadata and re-encoded as
+JPEG at MEDIA_JPEG_QUALITY (WhatsApp image messages and template headers
+accept JPEG/PNG only, so WebP isn't used). The work runs in a process pool
+so decoding large images never blocks the event loop. Workers are spawned,
+not forked: forking a process that already runs threads (DB pools, event
+loop) can deadlock the child on a lock held at fork time.
+
+Pillow is pinned in requirements.txt; if it's missing (e.g. a trimmed
+install) uploads are stored as is.
+
+Config (env):
+    MEDIA_OPTIMIZE          0 to store uploads unchanged (default 1)
+    MEDIA_MAX_DIMENSION     long-edge limit in pixels (default 1600)
+    MEDIA_JPEG_QUALITY      JPEG quality 1-95 (default 82)
+    MEDIA_KEEP_ORIGINAL     1 to also store the untouched original (default 0)
+    MEDIA_OPTIMIZE_WORKERS  optimizer processes (default 2)
+"""
+
+import os
+import asyncio
+import multiprocessing
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Optional
+
+MEDIA_OPTIMIZE = os.getenv("MEDIA_OPTIMIZE", "1") == "1"
+MEDIA_MAX_DIMENSION = int(os.getenv("MEDIA_MAX_DIMENSION", "1600"))
+MEDIA_JPEG_QUALITY = int(os.getenv("MEDIA_JPEG_QUALITY", "82"))
+MEDIA_KEEP_ORIGINAL = os.getenv("MEDIA_KEEP_ORIGINAL", "0") == "1"
+MEDIA_OPTIMIZE_WORKERS = int(os.getenv("MEDIA_OPTIMIZE_WORKERS", "2"))
+
+# Formats worth re-encoding (GIFs may be animated, so they're left alone)
+OPTIMIZABLE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+def _pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@dataclass
+class OptimizedImage:
+    path: str
+    size_bytes: int
+    width: int
+    height: int
+
+
+def optimize_image_file(src_path: str, max_dimension: int = MEDIA_MAX_DIMENSION,
+                        quality: int = MEDIA_JPEG_QUALITY) -> Optional[OptimizedImage]:
+    """
+    Resize / re-encode one image file to a new temp JPEG (runs in a worker process).
+    Returns None if the result isn't smaller than the source (e.g. small flat
+    PNGs, which JPEG encodes worse), so the original is kept.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as img:
+        # Lets the JPEG decoder scale down while decoding (much less memory)
+        img.draft("RGB", (max_dimension, max_dimension))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            # JPEG has no alpha: flatten transparent PNGs onto white
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        if max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        fd, out_path = tempfile.mkstemp(suffix=".jpg")
+        with os.fdopen(fd, "wb") as out:
+            # No exif/icc arguments: metadata is dropped
+            img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        width, height = img.size
+
+    size = os.path.getsize(out_path)
+    if size >= os.path.getsize(src_path):
+        os.remove(out_path)
+        return None
+    return OptimizedImage(path=out_path, size_bytes=size, width=width, height=height)
+
+
+def spool_to_path(file_obj, chunk_size: int = 1024 * 1024) -> str:
+    """Copy a (spooled) file object to a named temp file a worker process can open"""
+    file_obj.seek(0)
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(file_obj, out, chunk_size)
+    file_obj.seek(0)
+    return path
+
+
+class ImageOptimizer:
+    """Runs optimize_image_file on a lazily started process pool"""
+
+    def __init__(self, enabled: bool = MEDIA_OPTIMIZE, workers: int = MEDIA_OPTIMIZE_WORKERS):
+        if enabled and not _pillow_available():
+            print("⚠️ MEDIA_OPTIMIZE=1 but Pillow is not installed - storing uploads unchanged")
+            enabled = False
+        self.enabled = enabled
+        self.workers = max(1, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def accepts(self, content_type: Optional[str]) -> bool:
+        return self.enabled and content_type in OPTIMIZABLE_TYPES
+
+    async def optimize(self, src_path: str) -> Optional[OptimizedImage]:
+        """Optimized temp file (caller deletes it), or None to keep the original"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        pool = self._pool
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(pool, optimize_image_file, src_path)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM on a huge image): the pool is unusable,
+            # so drop it and start a fresh one on the next upload
+            print(f"⚠️ Image optimizer pool broke, keeping original: {e}")
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            return None
+        except Exception as e:
+            print(f"⚠️ Image optimization failed, keeping original: {e}")
+            return None
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
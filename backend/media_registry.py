@@ -0,0 +1,98 @@
+"""
+Media registry: uploads each campaign image to Meta once and sends it by
+media id, instead of having Meta fetch the same storage URL for every
+recipient.
+
+ensure() uploads the distinct URLs of a campaign to /{PHONE_ID}/media and
+caches the returned ids (Meta keeps uploaded media for 30 days; ids are
+reused for MEDIA_ID_TTL_HOURS). media_ref() is the MessagePayloadBuilder hook:
+{"id": ...} for registered URLs, {"link": url} otherwise - so a failed upload
+just falls back to the old link behavior.
+
+Config (env):
+    MEDIA_ID_TTL_HOURS        how long a media id is reused (default 600)
+    MEDIA_RETRY_SECONDS       wait before retrying a failed upload (default 300)
+    MEDIA_UPLOAD_CONCURRENCY  parallel uploads per ensure() (default 5)
+"""
+
+import os
+import asyncio
+from typing import Any, Dict, Iterable, Optional
+
+import httpx
+
+from cache import TTLCache
+from graph_client import graph
+
+MEDIA_ID_TTL_HOURS = float(os.getenv("MEDIA_ID_TTL_HOURS", "600"))
+MEDIA_RETRY_SECONDS = float(os.getenv("MEDIA_RETRY_SECONDS", "300"))
+MEDIA_UPLOAD_CONCURRENCY = int(os.getenv("MEDIA_UPLOAD_CONCURRENCY", "5"))
+
+_FAILED = ""  # cached in place of an id after a failed upload
+
+
+class MediaRegistry:
+    """URL -> Meta media id, with expiry"""
+
+    def __init__(self, media_url: str, token: Optional[str],
+                 ttl_hours: float = MEDIA_ID_TTL_HOURS, concurrency: int = MEDIA_UPLOAD_CONCURRENCY):
+        """media_url: https://graph.facebook.com/{version}/{PHONE_ID}/media"""
+        self.media_url = media_url
+        self.token = token
+        self.concurrency = max(1, concurrency)
+        self._ids = TTLCache(ttl=ttl_hours * 3600, maxsize=4096)
+        self.uploads = 0
+        self.failures = 0
+
+    def media_ref(self, url: str) -> Dict[str, str]:
+        """Image object for a send: by id if uploaded, else by link"""
+        media_id = self._ids.get(url)
+        return {"id": media_id} if media_id else {"link": url}
+
+    async def ensure(self, urls: Iterable[str]):
+        """Upload every URL that has no live media id (failures fall back to link)"""
+        if not self.token:
+            return
+        pending = [url for url in dict.fromkeys(urls) if url and self._ids.get(url) is None]
+        if not pending:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def register(url: str):
+            async with semaphore:
+                media_id = await self._upload(url)
+            if media_id:
+                self._ids.set(url, media_id)
+            else:
+                self._ids.set(url, _FAILED, ttl=MEDIA_RETRY_SECONDS)
+
+        await asyncio.gather(*(register(url) for url in pending))
+        print(f"🖼️ Media registry: {len(pending)} uploaded/attempted, {self.failures} failures so far")
+
+    async def _upload(self, url: str) -> Optional[str]:
+        try:
+            image = await graph.get(url, timeout=30, follow_redirects=True)
+            if image.status_code != 200:
+                raise ValueError(f"download returned {image.status_code}")
+            content_type = image.headers.get("content-type", "image/jpeg").split(";")[0]
+            filename = url.rsplit("/", 1)[-1].split("?")[0] or "image"
+
+            res = await graph.post(
+                self.media_url,
+                headers={"Authorization": f"Bearer {self.token}"},
+                data={"messaging_product": "whatsapp", "type": content_type},
+                files={"file": (filename, image.content, content_type)},
+                timeout=60
+            )
+            data = res.json()
+            if "id" not in data:
+                raise ValueError(data.get("error", {}).get("message", str(data)))
+            self.uploads += 1
+            return data["id"]
+        except (httpx.HTTPError, ValueError) as e:
+            self.failures += 1
+            print(f"⚠️ Media upload failed for {url[:60]}, sending by link: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"uploads": self.uploads, "failures": self.failures, **self._ids.stats()}
@@ -36,6 +36,11 @@ class MediaUpload(BaseModel):
     """Response model for media upload"""
     storage_url: str
     filename: str
+    size_bytes: Optional[int] = None
+    bytes_per_sec: Optional[float] = None
+    deduplicated: bool = False
+    optimized: bool = False
+    original_url: Optional[str] = None
 
 
 class Campaign(BaseModel):
@@ -0,0 +1,130 @@
+"""
+WhatsApp template payload builder shared by /send-message and campaigns.
+
+Routing (the Decision Engine):
+    2+ images -> carousel template   (bakked_carousel_v1, max 10 cards)
+    1 image   -> image CTA template  (bakked_image_cta_v1)
+    0 images  -> plain text template (bakked_text_v1)
+
+The static JSON around each template shape is serialized once, and media
+components (image header / carousel cards) are serialized once per distinct
+set of media refs and cached. Building a recipient's payload then only encodes the
+`to` number and body text and joins pre-built JSON fragments.
+"""
+
+import json
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+CAROUSEL_TEMPLATE = "bakked_carousel_v1"
+IMAGE_CTA_TEMPLATE = "bakked_image_cta_v1"
+TEXT_TEMPLATE = "bakked_text_v1"
+MAX_CAROUSEL_CARDS = 10  # Meta limit
+
+
+def to_json(value: Any) -> str:
+    """Compact JSON used for all payload fragments"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def link_media(url: str) -> Dict[str, str]:
+    """Default media reference: let Meta fetch the URL"""
+    return {"link": url}
+
+
+def template_for(media_count: int) -> str:
+    """Default template name for a number of images"""
+    if media_count > 1:
+        return CAROUSEL_TEMPLATE
+    if media_count == 1:
+        return IMAGE_CTA_TEMPLATE
+    return TEXT_TEMPLATE
+
+
+class MessagePayloadBuilder:
+    """Builds Meta template message payloads from pre-serialized parts"""
+
+    _HEAD = '{"messaging_product":"whatsapp","to":'
+    _TAIL = "]}}"
+
+    def __init__(self, language: str = "en_US",
+                 media_ref: Callable[[str], Dict[str, str]] = link_media,
+                 max_cached_media: int = 512):
+        """
+        media_ref: maps an image URL to Meta's image object ({"link": ...}
+            by default)
+        """
+        self.language = language
+        self.media_ref = media_ref
+        self.max_cached_media = max_cached_media
+        self._template_parts: Dict[str, str] = {}
+        self._media_parts: Dict[Tuple[str, ...], str] = {}
+
+    def _template_part(self, template_name: str) -> str:
+        part = self._template_parts.get(template_name)
+        if part is None:
+            part = (',"type":"template","template":{"name":' + to_json(template_name)
+                    + ',"language":{"code":' + to_json(self.language) + '},"components":[')
+            self._template_parts[template_name] = part
+        return part
+
+    def _media_part(self, media_urls: Tuple[str, ...]) -> str:
+        """
+        Serialized header (1 image) or carousel (2+) component, cached per
+        set of resolved media refs (so a changed or expired media id isn't reused)
+        """
+        refs = [self.media_ref(url) for url in media_urls]
+        key = tuple(ref.get("id") or ref.get("link") for ref in refs)
+        part = self._media_parts.get(key)
+        if part is not None:
+            return part
+        if len(media_urls) == 1:
+            part = to_json({
+                "type": "header",
+                "parameters": [{"type": "image", "image": refs[0]}]
+            })
+        else:
+            part = to_json({
+                "type": "carousel",
+                "cards": [
+                    {
+                        "card_index": i,
+                        "components": [{
+                            "type": "header",
+                            "parameters": [{"type": "image", "image": ref}]
+                        }]
+                    } for i, ref in enumerate(refs)
+                ]
+            })
+        if len(self._media_parts) >= self.max_cached_media:
+            self._media_parts.clear()
+        self._media_parts[key] = part
+        return part
+
+    @staticmethod
+    def _body_part(text: str) -> str:
+        return '{"type":"body","parameters":[{"type":"text","text":' + to_json(text) + "}]}"
+
+    def build_json(self, to: str, text: Optional[str] = None, media_urls: Sequence[str] = (),
+                   template_name: Optional[str] = None) -> bytes:
+        """
+        Serialized payload for one recipient.
+        to: phone number (a leading + is stripped, Meta expects digits)
+        """
+        urls = tuple(media_urls[:MAX_CAROUSEL_CARDS])
+        components = []
+        if text:
+            components.append(self._body_part(text))
+        if len(urls) == 1:
+            # Image header goes before the body
+            components.insert(0, self._media_part(urls))
+        elif urls:
+            components.append(self._media_part(urls))
+
+        name = template_name or template_for(len(urls))
+        return (self._HEAD + to_json(to.replace("+", "")) + self._template_part(name)
+                + ",".join(components) + self._TAIL).encode()
+
+    def build(self, to: str, text: Optional[str] = None, media_urls: Sequence[str] = (),
+              template_name: Optional[str] = None) -> Dict[str, Any]:
+        """Same payload as build_json, as a dict (for logging / dry runs)"""
+        return json.loads(self.build_json(to, text, media_urls, template_name))
@@ -0,0 +1,103 @@
+"""
+Message personalization: compile a message once, render it per recipient.
+
+A message like "Hi [Name], it's been [Days] days!" is parsed once into a
+token list (literal text and placeholders). Rendering a contact is then a
+single pass over the tokens, with the "now" reference for [Days] taken once
+per campaign instead of once per recipient.
+
+Placeholders:
+    [Name]   contact name, or "Friend"
+    [Phone]  contact phone
+    [Days]   days since last_visit ("some" if unparseable, "" if missing)
+    [field]  any other contact field present on the row (e.g. [tags]);
+             unknown placeholders are left as written
+"""
+
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+PLACEHOLDER_RE = re.compile(r"\[([A-Za-z_][A-Za-z0-9_]*)\]")
+
+# Token kinds
+LITERAL, NAME, PHONE, DAYS, FIELD = range(5)
+BUILTINS = {"Name": NAME, "Phone": PHONE, "Days": DAYS}
+
+
+@dataclass(frozen=True)
+class RenderClock:
+    """The 'now' used for [Days], fixed for a whole campaign"""
+    utc: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    local: datetime = field(default_factory=datetime.now)
+
+
+def days_since(last_visit: str, now: RenderClock) -> str:
+    """Whole days since an ISO timestamp, as text for [Days]"""
+    try:
+        lv = datetime.fromisoformat(last_visit.replace("Z", "+00:00"))
+    except (ValueError, AttributeError):
+        return "some"
+    reference = now.utc if lv.tzinfo else now.local
+    return str((reference - lv).days)
+
+
+class MessageTemplate:
+    """A message parsed into literal / placeholder tokens"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens: List[Tuple[int, str]] = []
+        pos = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            if match.start() > pos:
+                self.tokens.append((LITERAL, text[pos:match.start()]))
+            name = match.group(1)
+            self.tokens.append((BUILTINS.get(name, FIELD), name))
+            pos = match.end()
+        if pos < len(text):
+            self.tokens.append((LITERAL, text[pos:]))
+        self.is_static = all(kind == LITERAL for kind, _ in self.tokens)
+
+    def render(self, contact: Dict[str, Any], now: Optional[RenderClock] = None) -> str:
+        """Fill placeholders for one contact in a single pass"""
+        if self.is_static:
+            return self.text
+        parts = []
+        for kind, value in self.tokens:
+            if kind == LITERAL:
+                parts.append(value)
+            elif kind == NAME:
+                parts.append(contact.get("name") or "Friend")
+            elif kind == PHONE:
+                parts.append(contact.get("phone") or "")
+            elif kind == DAYS:
+                last_visit = contact.get("last_visit")
+                parts.append(days_since(last_visit, now or RenderClock()) if last_visit else "")
+            elif value in contact:
+                field_value = contact[value]
+                parts.append("" if field_value is None else str(field_value))
+            else:
+                parts.append(f"[{value}]")
+        return "".join(parts)
+
+    def render_many(self, contacts: Iterable[Dict[str, Any]], now: Optional[RenderClock] = None) -> List[str]:
+        """Render a batch of contacts against one shared clock"""
+        now = now or RenderClock()
+        return [self.render(c, now) for c in contacts]
+
+
+@lru_cache(maxsize=256)
+def compile_template(text: str) -> MessageTemplate:
+    """Parse a message once; repeated calls with the same text are cached"""
+    return MessageTemplate(text)
+
+
+def render_message(template: Union[str, MessageTemplate], contact: Dict[str, Any],
+                   now: Optional[RenderClock] = None) -> str:
+    """Render a message (text or compiled) for one contact"""
+    if isinstance(template, str):
+        template = compile_template(template)
+    return template.render(contact, now)
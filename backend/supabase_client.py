@@ -1,7 +1,17 @@
 import os
+import re
+import asyncio
+import functools
+import json
+import uuid
+import base64
+import hashlib
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, BinaryIO, Callable, Iterator, AsyncIterator, Union
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from datetime import date, datetime, timedelta, timezone
 
 load_dotenv()
 
@@ -24,6 +34,49 @@ def get_supabase_client() -> Optional[Client]:
         return None
 
 
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Opaque pagination cursor for a contact row (created_at, id)"""
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor from encode_cursor, raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, contact_id = json.loads(raw)
+        # Values are interpolated into PostgREST filters; keep them plain
+        uuid.UUID(str(contact_id))
+        datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return created_at, contact_id
+
+
+# Terms made only of digits and phone punctuation ("+91 98765", "(987) 65-43")
+PHONE_TERM = re.compile(r"^[\d\s+().-]+$")
+
+
+def contact_search_filter(search: str) -> str:
+    """
+    PostgREST or-filter body matching name, or also the digits-only phone
+    when the term looks like a phone number with 3+ digits (what the trigram
+    index can serve; "Ravi 2" or "7" would match nearly every phone). Values
+    are double-quoted so commas/parens in the term can't break the filter.
+    """
+    term = search.replace("\\", "\\\\").replace('"', '\\"')
+    parts = [f'name.ilike."%{term}%"']
+    digits = re.sub(r"\D", "", search)
+    if len(digits) >= 3 and PHONE_TERM.match(search.strip()):
+        parts.append(f'phone_digits.ilike."%{digits}%"')
+    return ",".join(parts)
+
+
+# wamid.* ids are ~60 chars (more URL-encoded) and travel in the query string
+# as in.(...); 50 per request keeps URLs around 4 KB, well under gateway limits
+STATUS_UPDATE_CHUNK = 50
+
+
 class SupabaseDB:
     """Wrapper for Supabase database operations"""
     
@@ -31,47 +84,151 @@ class SupabaseDB:
         self.client = get_supabase_client()
     
     # ---------- Contacts ----------
-    def get_contacts(self, limit: int = 100, page: int = 1, search: str = None) -> Dict[str, Any]:
-        """Fetch paginated contacts"""
+    def get_contacts(self, limit: int = 100, page: int = 1, search: str = None,
+                     count_mode: str = "exact", cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fetch paginated contacts and the total count in one request.
+        count_mode: exact / planned / estimated (PostgREST Prefer: count=...)
+            or none to skip counting; planned/estimated avoid a full count(*)
+        cursor: next_cursor from a previous response; when given, the page
+            starts right after that row (keyset on created_at, id) instead of
+            at an offset, so deep pages cost the same as the first. The count
+            then covers the rows from the cursor onward.
+        """
         if not self.client:
-            return {"contacts": [], "count": 0}
+            return {"contacts": [], "count": 0, "next_cursor": None}
         
         offset = (page - 1) * limit
+        count = None if count_mode == "none" else count_mode
         
         try:
             # Build query
-            query = self.client.table("contacts").select("*", count="exact")
+            query = self.client.table("contacts").select("*", count=count)
             
+            filters = []
             if search:
-                # Search in name OR phone
-                query = query.or_(f"name.ilike.%{search}%,phone.ilike.%{search}%")
+                # Search in name OR phone (trigram-indexed, see migration_v9)
+                filters.append(contact_search_filter(search))
+            if cursor:
+                ts, cid = decode_cursor(cursor)
+                filters.append(f'created_at.lt."{ts}",and(created_at.eq."{ts}",id.lt.{cid})')
+            if len(filters) == 1:
+                query = query.or_(filters[0])
+            elif filters:
+                # PostgREST takes one `or` param: AND the two OR groups inside it
+                query = query.or_(f"and(or({filters[0]}),or({filters[1]}))")
             
-            # Get total count (with filters applied)
-            count_res = query.limit(0).execute()
-            total = count_res.count if hasattr(count_res, 'count') else 0
+            # Newest first; id breaks created_at ties so pages never overlap
+            query = query.order("created_at.desc,id", desc=True)
+            if cursor:
+                query = query.limit(limit)
+            else:
+                query = query.range(offset, offset + limit - 1)
             
-            # Get data
-            response = query\
-                .order("created_at", desc=True)\
-                .range(offset, offset + limit - 1)\
-                .execute()
+            # Rows and count come back in the same response
+            response = query.execute()
+            rows = response.data or []
             
             return {
-                "contacts": response.data or [],
-                "count": total
+                "contacts": rows,
+                "count": response.count if count else None,
+                "count_mode": count_mode,
+                "next_cursor": encode_cursor(rows[-1]) if len(rows) == limit else None
             }
         except Exception as e:
             print(f"Error fetching contacts: {e}")
-            return {"contacts": [], "count": 0}
+            return {"contacts": [], "count": 0, "next_cursor": None}
     
-    def get_contacts_all(self) -> List[Dict[str, Any]]:
-        """Fetch ALL contacts for internal filtering"""
-        if not self.client:
+    def search_contacts(self, query: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Ranked contact search by name or phone digits (search_contacts RPC)"""
+        if not self.client or not query.strip():
             return []
-        # TODO: Implement pagination if > 1000
-        response = self.client.table("contacts").select("*").limit(5000).execute()
+        response = self.client.rpc("search_contacts", {"q": query, "max_results": limit}).execute()
         return response.data or []
     
+    def iter_contacts(self, page_size: int = 1000, columns: str = "*",
+                      query_filter: Optional[Callable[[Any], Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream ALL contacts page by page, keyset-paginated on (created_at, id).
+        
+        page_size: rows fetched per request
+        columns: PostgREST column list (created_at and id are always added)
+        query_filter: optional function that adds filters to each page query
+            (must not use or_, which the keyset condition needs)
+        """
+        if not self.client:
+            return
+        if columns != "*":
+            wanted = [c.strip() for c in columns.split(",")]
+            columns = ",".join(wanted + [c for c in ("created_at", "id") if c not in wanted])
+        
+        last = None
+        while True:
+            query = self.client.table("contacts").select(columns)
+            if query_filter:
+                query = query_filter(query)
+            if last:
+                ts, cid = last
+                query = query.or_(f'created_at.gt."{ts}",and(created_at.eq."{ts}",id.gt.{cid})')
+            # Single order param covering both keys: created_at ASC, id ASC
+            rows = query.order("created_at,id").limit(page_size).execute().data or []
+            yield from rows
+            if len(rows) < page_size:
+                break
+            last = (rows[-1]["created_at"], rows[-1]["id"])
+    
+    def iter_contacts_by_month_day(self, field: str, start: date, end: Optional[date] = None,
+                                   page_size: int = 1000, columns: str = "*") -> Iterator[Dict[str, Any]]:
+        """
+        Stream contacts whose dob/anniversary falls between start and end
+        (month and day only, any year; end defaults to start).
+        Uses the indexed {field}_md columns from migration_v8.
+        """
+        if field not in ("dob", "anniversary"):
+            raise ValueError(f"Unsupported month-day field: {field}")
+        column = f"{field}_md"
+        lo = start.month * 100 + start.day
+        end = end or start
+        hi = end.month * 100 + end.day
+        # A range crossing New Year (e.g. Dec 30 -> Jan 2) becomes two scans
+        ranges = [(lo, hi)] if lo <= hi else [(lo, 1231), (101, hi)]
+        for a, b in ranges:
+            if a == b:
+                query_filter = lambda q, a=a: q.eq(column, a)
+            else:
+                query_filter = lambda q, a=a, b=b: q.gte(column, a).lte(column, b)
+            yield from self.iter_contacts(page_size=page_size, columns=columns, query_filter=query_filter)
+    
+    @staticmethod
+    def month_day_filter(field: str, day: date) -> Callable[[Any], Any]:
+        """Query filter: dob/anniversary falls on this month and day (indexed)"""
+        if field not in ("dob", "anniversary"):
+            raise ValueError(f"Unsupported month-day field: {field}")
+        return lambda q: q.eq(f"{field}_md", day.month * 100 + day.day)
+    
+    @staticmethod
+    def last_visit_on_filter(day: date) -> Callable[[Any], Any]:
+        """Query filter: last_visit falls on this (UTC) calendar day"""
+        start = f"{day.isoformat()}T00:00:00+00:00"
+        end = f"{(day + timedelta(days=1)).isoformat()}T00:00:00+00:00"
+        return lambda q: q.gte("last_visit", start).lt("last_visit", end)
+    
+    def count_contacts(self, query_filter: Optional[Callable[[Any], Any]] = None,
+                       count: str = "exact") -> int:
+        """Count contacts matching a filter, fetching at most one id"""
+        if not self.client:
+            return 0
+        # GET, not head=True: postgrest-py reads a HEAD response as count=0
+        query = self.client.table("contacts").select("id", count=count)
+        if query_filter:
+            query = query_filter(query)
+        response = query.limit(1).execute()
+        return response.count or 0
+    
+    def get_contacts_all(self) -> List[Dict[str, Any]]:
+        """Fetch ALL contacts as a list (prefer iter_contacts for large sets)"""
+        return list(self.iter_contacts())
+    
     def get_contact_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
         """Get contact by phone number"""
         if not self.client:
@@ -99,6 +256,20 @@ class SupabaseDB:
         response = self.client.table("contacts").upsert(data, on_conflict="phone").execute()
         return response.data[0] if response.data else {}
     
+    def upsert_contacts_bulk(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Upsert many contacts on phone. Rows are grouped by their set of
+        columns so a blank cell never overwrites an existing value with NULL.
+        """
+        if not self.client or not rows:
+            return 0
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            self.client.table("contacts").upsert(group, on_conflict="phone", returning="minimal").execute()
+        return len(rows)
+    
     def delete_contact(self, contact_id: str) -> bool:
         """Delete a contact"""
         if not self.client:
@@ -119,13 +290,152 @@ class SupabaseDB:
         response = self.client.table("campaigns").insert(data).execute()
         return response.data[0] if response.data else {}
     
+    # Funnel counters are maintained by the trigger in migration_v7 (no log scans)
+    CAMPAIGN_LIST_COLUMNS = (
+        "id, name, group_id, message_text, campaign_type, status, total_recipients, "
+        "sent_count, failed_count, delivered_count, read_count, sent_at, finished_at"
+    )
+
     def get_campaigns(self, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get all campaigns"""
+        """Get all campaigns with their live sent/delivered/read counters"""
         if not self.client:
             return []
-        response = self.client.table("campaigns").select("*").order("sent_at", desc=True).limit(limit).execute()
+        response = self.client.table("campaigns").select(self.CAMPAIGN_LIST_COLUMNS)\
+            .order("sent_at", desc=True).limit(limit).execute()
         return response.data or []
+
+    # ---------- Campaign Jobs ----------
+    def create_campaign_job(self, name: str, message_text: str, campaign_type: str,
+                            payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Create an 'enqueuing' campaign row holding the job's request payload"""
+        if not self.client:
+            return {}
+        data = {
+            "name": name,
+            "message_text": message_text,
+            "campaign_type": campaign_type,
+            "payload": payload,
+            # Not resumable until every recipient row is written (then 'queued')
+            "status": "enqueuing",
+            "heartbeat_at": datetime.now(timezone.utc).isoformat(),
+            "total_recipients": 0
+        }
+        response = self.client.table("campaigns").insert(data).execute()
+        return response.data[0] if response.data else {}
+
+    def get_campaign(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """Get a single campaign by ID"""
+        if not self.client:
+            return None
+        response = self.client.table("campaigns").select("*").eq("id", campaign_id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def update_campaign(self, campaign_id: str, data: Dict[str, Any]) -> bool:
+        """Update fields on a campaign row"""
+        if not self.client:
+            return False
+        response = self.client.table("campaigns").update(data).eq("id", campaign_id).execute()
+        return len(response.data) > 0 if response.data else False
+
+    def get_unfinished_campaigns(self, stale_before: str) -> List[Dict[str, Any]]:
+        """Queued/running campaign jobs with no heartbeat since stale_before"""
+        if not self.client:
+            return []
+        response = self.client.table("campaigns").select("id, status")\
+            .in_("status", ["queued", "running"])\
+            .or_(f'heartbeat_at.is.null,heartbeat_at.lt."{stale_before}"')\
+            .order("sent_at").execute()
+        return response.data or []
+
+    def claim_campaign_job(self, campaign_id: str, stale_before: str) -> bool:
+        """
+        Take ownership of a queued/running job, unless another process has
+        heartbeated it since stale_before. Conditional, so only one claimer wins.
+        """
+        if not self.client:
+            return False
+        response = self.client.table("campaigns").update({"heartbeat_at": datetime.now(timezone.utc).isoformat()})\
+            .eq("id", campaign_id).in_("status", ["queued", "running"])\
+            .or_(f'heartbeat_at.is.null,heartbeat_at.lt."{stale_before}"').execute()
+        return bool(response.data)
+
+    def fail_abandoned_campaign_jobs(self, stale_before: str) -> int:
+        """Mark 'enqueuing' jobs whose enqueue stopped heartbeating (process died) as failed"""
+        if not self.client:
+            return 0
+        response = self.client.table("campaigns").update({"status": "failed"})\
+            .eq("status", "enqueuing")\
+            .or_(f'heartbeat_at.is.null,heartbeat_at.lt."{stale_before}"').execute()
+        return len(response.data or [])
     
+    def add_campaign_recipients(self, campaign_id: str, contacts: List[Dict[str, Any]],
+                                start_position: int = 0) -> int:
+        """Insert pending recipient rows for a campaign, returns rows inserted"""
+        if not self.client or not contacts:
+            return 0
+        rows = [{
+            "campaign_id": campaign_id,
+            "contact_id": c.get("id"),
+            "position": start_position + i,
+            "phone": c["phone"],
+            "contact": c,
+            "status": "pending"
+        } for i, c in enumerate(contacts)]
+        self.client.table("campaign_recipients").insert(rows).execute()
+        return len(rows)
+
+    def get_pending_campaign_recipients(self, campaign_id: str, limit: int = 200) -> List[Dict[str, Any]]:
+        """Next chunk of unsent recipients, in send order"""
+        if not self.client:
+            return []
+        response = self.client.table("campaign_recipients").select("*")\
+            .eq("campaign_id", campaign_id).eq("status", "pending")\
+            .order("position").limit(limit).execute()
+        return response.data or []
+
+    def claim_campaign_recipients(self, campaign_id: str, first_position: int,
+                                  last_position: int) -> List[Dict[str, Any]]:
+        """
+        Move the pending recipients in a position range to 'sending', returns
+        the claimed rows. Only rows claimed here may be sent.
+        """
+        if not self.client:
+            return []
+        response = self.client.table("campaign_recipients").update({"status": "sending"})\
+            .eq("campaign_id", campaign_id).eq("status", "pending")\
+            .gte("position", first_position).lte("position", last_position).execute()
+        return sorted(response.data or [], key=lambda row: row["position"])
+
+    def fail_interrupted_campaign_recipients(self, campaign_id: str) -> int:
+        """Mark recipients left in 'sending' (send outcome unknown) as failed"""
+        if not self.client:
+            return 0
+        response = self.client.table("campaign_recipients").update({
+            "status": "failed",
+            "error": "Interrupted mid-send, not retried (may have been delivered)",
+            "updated_at": "now()"
+        }).eq("campaign_id", campaign_id).eq("status", "sending").execute()
+        return len(response.data or [])
+
+    def count_campaign_recipients(self, campaign_id: str) -> Dict[str, int]:
+        """Recipient counts per status for a campaign"""
+        counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0}
+        if not self.client:
+            return counts
+        for status in counts:
+            # GET + limit(1), not head=True: postgrest-py reads HEAD as count=0
+            response = self.client.table("campaign_recipients").select("id", count="exact")\
+                .eq("campaign_id", campaign_id).eq("status", status).limit(1).execute()
+            counts[status] = response.count or 0
+        return counts
+
+    def checkpoint_campaign_recipients(self, rows: List[Dict[str, Any]]) -> bool:
+        """Persist the outcome of a processed chunk in one bulk upsert"""
+        if not self.client or not rows:
+            return False
+        self.client.table("campaign_recipients").upsert(rows, on_conflict="id").execute()
+        return True
+
     # ---------- Message Logs ----------
     def create_message_log(self, contact_id: str, wa_id: str, campaign_id: Optional[str] = None) -> Dict[str, Any]:
         """Create a message log entry"""
@@ -140,7 +450,14 @@ class SupabaseDB:
             data["campaign_id"] = campaign_id
         response = self.client.table("message_logs").insert(data).execute()
         return response.data[0] if response.data else {}
-    
+
+    def create_message_logs_bulk(self, rows: List[Dict[str, Any]]) -> int:
+        """Insert many message log rows in one request, returns rows sent"""
+        if not self.client or not rows:
+            return 0
+        self.client.table("message_logs").insert(rows, returning="minimal").execute()
+        return len(rows)
+
     def update_message_status(self, wa_id: str, status: str) -> bool:
         """Update message status by WhatsApp message ID"""
         if not self.client:
@@ -151,6 +468,24 @@ class SupabaseDB:
         }).eq("wa_id", wa_id).execute()
         return len(response.data) > 0 if response.data else False
     
+    def update_message_status_bulk(self, wa_ids: List[str], status: str,
+                                   from_statuses: Optional[List[str]] = None) -> bool:
+        """
+        Set one status on many messages (one request per STATUS_UPDATE_CHUNK ids).
+        If from_statuses is given, only rows currently in one of those
+        statuses are touched, so a late 'delivered' can't overwrite 'read'.
+        """
+        if not self.client or not wa_ids:
+            return False
+        data = {"status": status, "updated_at": "now()"}
+        for i in range(0, len(wa_ids), STATUS_UPDATE_CHUNK):
+            query = self.client.table("message_logs").update(data, returning="minimal")\
+                .in_("wa_id", wa_ids[i:i + STATUS_UPDATE_CHUNK])
+            if from_statuses:
+                query = query.in_("status", from_statuses)
+            query.execute()
+        return True
+
     def get_message_logs(self, limit: int = 100) -> List[Dict[str, Any]]:
         """Get recent message logs with contact info"""
         if not self.client:
@@ -161,15 +496,30 @@ class SupabaseDB:
         return response.data or []
     
     # ---------- Media ----------
-    def save_media_record(self, storage_url: str, meta_id: Optional[str] = None) -> Dict[str, Any]:
-        """Save media record to database"""
+    def save_media_record(self, storage_url: str, meta_id: Optional[str] = None,
+                          sha256: Optional[str] = None, filename: Optional[str] = None,
+                          content_type: Optional[str] = None, size_bytes: Optional[int] = None,
+                          original_url: Optional[str] = None) -> Dict[str, Any]:
+        """Save media record to database (a row with the same sha256 is kept as is)"""
         if not self.client:
             return {}
         data = {"storage_url": storage_url}
         if meta_id:
             data["meta_id"] = meta_id
-        response = self.client.table("media").insert(data).execute()
+        if sha256:
+            data.update({"sha256": sha256, "filename": filename, "content_type": content_type,
+                         "size_bytes": size_bytes, "original_url": original_url})
+            response = self.client.table("media").upsert(data, on_conflict="sha256", ignore_duplicates=True).execute()
+        else:
+            response = self.client.table("media").insert(data).execute()
         return response.data[0] if response.data else {}
+    
+    def get_media_by_hash(self, sha256: str) -> Optional[Dict[str, Any]]:
+        """Previously uploaded media with identical content, if any"""
+        if not self.client:
+            return None
+        response = self.client.table("media").select("*").eq("sha256", sha256).limit(1).execute()
+        return response.data[0] if response.data else None
 
     # ---------- Templates (Local) ----------
     def create_local_template(self, name: str, message_text: str, category: str, 
@@ -234,6 +584,17 @@ class SupabaseDB:
         except:
             return False
 
+    def update_contacts_last_message_bulk(self, contact_ids: List[str], group_name: str,
+                                          sent_at: Optional[str] = None) -> bool:
+        """Set last message timestamp and group on many contacts (one request per 200 ids)"""
+        if not self.client or not contact_ids:
+            return False
+        data = {"last_message_at": sent_at or "now()", "last_message_group": group_name}
+        for i in range(0, len(contact_ids), 200):
+            self.client.table("contacts").update(data, returning="minimal")\
+                .in_("id", contact_ids[i:i + 200]).execute()
+        return True
+
     def delete_local_template(self, template_id: str) -> bool:
         """Delete a local template"""
         if not self.client:
@@ -292,6 +653,56 @@ class SupabaseDB:
         except Exception as e:
             print(f"Error updating template by meta_name: {e}")
             return False
+    
+    def get_meta_linked_templates(self) -> List[Dict[str, Any]]:
+        """Local templates that have been submitted to Meta (for sync diffs)"""
+        if not self.client:
+            return []
+        response = self.client.table("message_templates")\
+            .select("id, meta_name, meta_status, quality_score")\
+            .not_.is_("meta_name", "null").execute()
+        return response.data or []
+    
+    def update_templates_meta_bulk(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Apply Meta-owned fields (e.g. meta_status, quality_score) to many
+        templates: rows are {"id": ..., <fields>}, written as one update per
+        distinct set of values. Only those columns are sent, so local edits
+        made since the rows were read are never overwritten.
+        """
+        if not self.client or not rows:
+            return 0
+        by_fields: Dict[tuple, List[str]] = {}
+        for row in rows:
+            fields = tuple(sorted((k, v) for k, v in row.items() if k != "id"))
+            by_fields.setdefault(fields, []).append(row["id"])
+        for fields, ids in by_fields.items():
+            for i in range(0, len(ids), 200):
+                self.client.table("message_templates").update(dict(fields), returning="minimal")\
+                    .in_("id", ids[i:i + 200]).execute()
+        return len(rows)
+    
+    # ---------- Meta Header Handles ----------
+    def get_header_handle(self, sha256: Optional[str] = None, source_url: Optional[str] = None,
+                          etag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Unexpired cached header_handle, by image hash or by source URL + ETag"""
+        if not self.client or not (sha256 or (source_url and etag)):
+            return None
+        query = self.client.table("meta_header_handles").select("*")\
+            .gt("expires_at", datetime.now(timezone.utc).isoformat())
+        if sha256:
+            query = query.eq("sha256", sha256)
+        else:
+            query = query.eq("source_url", source_url).eq("etag", etag)
+        response = query.limit(1).execute()
+        return response.data[0] if response.data else None
+    
+    def save_header_handle(self, row: Dict[str, Any]) -> bool:
+        """Cache an uploaded image's header_handle (replaces any row for the same hash)"""
+        if not self.client:
+            return False
+        self.client.table("meta_header_handles").upsert(row, on_conflict="sha256", returning="minimal").execute()
+        return True
 
 
 class SupabaseStorage:
@@ -302,17 +713,40 @@ class SupabaseStorage:
     def __init__(self):
         self.client = get_supabase_client()
     
-    def upload_file(self, file_data: bytes, filename: str, content_type: str) -> Optional[str]:
-        """Upload file to Supabase storage and return public URL"""
+    @staticmethod
+    def sha256_file(file_obj: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+        """SHA-256 of a file object, read in chunks (position is reset to 0)"""
+        digest = hashlib.sha256()
+        file_obj.seek(0)
+        for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+            digest.update(chunk)
+        file_obj.seek(0)
+        return digest.hexdigest()
+    
+    def upload_file(self, file_data: Union[bytes, BinaryIO], filename: str, content_type: str,
+                    content_hash: Optional[str] = None) -> Optional[str]:
+        """
+        Upload file to Supabase storage and return public URL.
+        file_data may be bytes or a file object (e.g. a spooled temp file),
+        which is streamed from disk instead of being read into memory.
+        content_hash: store under the content's SHA-256 instead of a random
+        prefix, so identical files share one object.
+        """
         if not self.client:
             return None
         
         # Generate unique filename
         import uuid
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
+        unique_filename = f"{content_hash or uuid.uuid4().hex}_{filename}"
         file_path = f"uploads/{unique_filename}"
         
         try:
+            if not isinstance(file_data, bytes):
+                # storage3 streams BufferedReaders in chunks; reopen the file
+                # descriptor as one (a spooled file is moved to disk first)
+                file_data.seek(0)
+                file_data = open(file_data.fileno(), "rb", closefd=False)
+            
             # Upload to storage
             self.client.storage.from_(self.BUCKET_NAME).upload(
                 file_path,
@@ -324,6 +758,9 @@ class SupabaseStorage:
             public_url = self.client.storage.from_(self.BUCKET_NAME).get_public_url(file_path)
             return public_url
         except Exception as e:
+            if content_hash and "Duplicate" in str(e):
+                # Same bytes already stored under this name (e.g. a concurrent upload)
+                return self.client.storage.from_(self.BUCKET_NAME).get_public_url(file_path)
             print(f"❌ Upload error: {e}")
             return None
     
@@ -342,3 +779,47 @@ class SupabaseStorage:
 # Singleton instances
 db = SupabaseDB()
 storage = SupabaseStorage()
+
+
+# ---------- Async access ----------
+# Routes are async; calling the sync wrappers directly would block the event
+# loop (and every other request, webhooks included) for each round trip.
+# AsyncWrapper runs them on a bounded thread pool instead. Storage gets its
+# own pool so large uploads can't starve database reads.
+DB_THREADS = int(os.getenv("DB_THREADS", "16"))
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", "4"))
+
+
+class AsyncWrapper:
+    """Awaitable view of a sync wrapper: each method call runs on a bounded thread pool"""
+    
+    def __init__(self, target: Any, max_workers: int, name: str):
+        self._target = target
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return call
+    
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run any blocking callable (e.g. an ad-hoc client query) on this pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+    
+    async def iterate(self, iterator: Iterator[Any], batch_size: int = 500) -> AsyncIterator[Any]:
+        """Consume a blocking iterator (e.g. iter_contacts) in batches off the event loop"""
+        while True:
+            batch = await self.run(lambda: list(islice(iterator, batch_size)))
+            for item in batch:
+                yield item
+            if len(batch) < batch_size:
+                break
+
+
+adb = AsyncWrapper(db, DB_THREADS, "supabase-db")
+astorage = AsyncWrapper(storage, STORAGE_THREADS, "supabase-storage")
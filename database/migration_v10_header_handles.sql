@@ -0,0 +1,29 @@
+-- ========================================
+-- Migration v10: Cache of Meta header_handles for template images
+-- Run this in Supabase SQL Editor
+-- ========================================
+
+-- Submitting a template uploads each header / carousel image to Meta's
+-- resumable upload API to get a header_handle. The same product photo is
+-- often reused across templates, so handles are cached here by the image's
+-- SHA-256, with the source URL + ETag as a second key that lets a repeat
+-- submission skip even the download.
+CREATE TABLE IF NOT EXISTS meta_header_handles (
+    sha256 TEXT PRIMARY KEY,
+    source_url TEXT,
+    etag TEXT,
+    header_handle TEXT NOT NULL,
+    file_size BIGINT,
+    content_type TEXT,
+    expires_at TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_meta_header_handles_url
+ON meta_header_handles(source_url, etag) WHERE etag IS NOT NULL;
+
+-- Expired rows are ignored by the app; clean them up occasionally with:
+-- DELETE FROM meta_header_handles WHERE expires_at < NOW();
+
+-- Done!
+SELECT 'Migration v10 complete!' as status;
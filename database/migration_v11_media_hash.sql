@@ -0,0 +1,17 @@
+-- ========================================
+-- Migration v11: Content hash on media for upload deduplication
+-- Run this in Supabase SQL Editor
+-- ========================================
+
+-- /upload-media hashes each file (SHA-256) and, if the same bytes were
+-- uploaded before, returns the existing public URL instead of storing
+-- another copy. Older rows have no hash and are never matched.
+ALTER TABLE media ADD COLUMN IF NOT EXISTS sha256 TEXT;
+ALTER TABLE media ADD COLUMN IF NOT EXISTS size_bytes BIGINT;
+
+-- Plain (non-partial) unique index so it can be an upsert conflict target;
+-- NULL hashes don't conflict with each other
+CREATE UNIQUE INDEX IF NOT EXISTS idx_media_sha256 ON media(sha256);
+
+-- Done!
+SELECT 'Migration v11 complete!' as status;
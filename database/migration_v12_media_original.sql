@@ -0,0 +1,12 @@
+-- ========================================
+-- Migration v12: Keep a link to the original of optimized uploads
+-- Run this in Supabase SQL Editor
+-- ========================================
+
+-- /upload-media stores a resized, re-encoded JPEG as storage_url (the URL
+-- used in sends). With MEDIA_KEEP_ORIGINAL=1 the untouched upload is
+-- stored too and linked here; otherwise this stays NULL.
+ALTER TABLE media ADD COLUMN IF NOT EXISTS original_url TEXT;
+
+-- Done!
+SELECT 'Migration v12 complete!' as status;
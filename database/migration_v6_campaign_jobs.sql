@@ -0,0 +1,54 @@
+-- ========================================
+-- Migration v6: Durable background campaign jobs
+-- Run this in Supabase SQL Editor
+-- ========================================
+
+-- Job state on the campaign row
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS campaign_type TEXT;
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'completed';
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS payload JSONB;
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS failed_count INT DEFAULT 0;
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS started_at TIMESTAMPTZ;
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS finished_at TIMESTAMPTZ;
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ;
+
+-- Comment: campaigns.status values
+-- 'enqueuing' = Recipients still being written (failed, never resumed, if heartbeat_at goes stale)
+-- 'queued'    = Enqueued, worker not started yet
+-- 'running'   = Worker is sending (taken over once heartbeat_at goes stale)
+-- 'completed' = All recipients processed
+-- 'failed'    = Job aborted (see server logs)
+
+CREATE INDEX IF NOT EXISTS idx_campaigns_unfinished
+ON campaigns(status) WHERE status IN ('queued', 'running');
+
+-- ----------------------------------------
+-- Campaign Recipients: per-recipient send state
+-- ----------------------------------------
+CREATE TABLE IF NOT EXISTS campaign_recipients (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    campaign_id UUID NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    contact_id UUID REFERENCES contacts(id) ON DELETE SET NULL,
+    position INT NOT NULL,                 -- Send order within the campaign
+    phone TEXT NOT NULL,
+    contact JSONB,                         -- Snapshot used for personalization
+    status TEXT DEFAULT 'pending',         -- pending, sending, sent, failed
+    wa_id TEXT,
+    error TEXT,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(campaign_id, position)
+);
+
+-- Workers read the next chunk of pending recipients in position order
+CREATE INDEX IF NOT EXISTS idx_campaign_recipients_pending
+ON campaign_recipients(campaign_id, position) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_campaign_recipients_status
+ON campaign_recipients(campaign_id, status);
+
+ALTER TABLE campaign_recipients ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Full access" ON campaign_recipients;
+CREATE POLICY "Full access" ON campaign_recipients FOR ALL USING (true) WITH CHECK (true);
+
+-- Done!
+SELECT 'Migration v6 complete!' as status;
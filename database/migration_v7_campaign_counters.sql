@@ -0,0 +1,66 @@
+-- ========================================
+-- Migration v7: Live delivered/read counters on campaigns
+-- Run this in Supabase SQL Editor (after migration v6)
+-- ========================================
+
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS delivered_count INT DEFAULT 0;
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS read_count INT DEFAULT 0;
+
+-- Keep campaigns.delivered_count / read_count in step with message_logs.status.
+-- Statement-level with transition tables: a bulk status update from the
+-- webhook buffer bumps each campaign once per statement, not once per row.
+-- 'read' implies delivered, so a message jumping straight to read counts for both.
+CREATE OR REPLACE FUNCTION bump_campaign_funnel_counts()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE campaigns c
+  SET
+    delivered_count = COALESCE(c.delivered_count, 0) + d.delivered,
+    read_count = COALESCE(c.read_count, 0) + d.read
+  FROM (
+    SELECT
+      n.campaign_id,
+      COUNT(*) FILTER (
+        WHERE n.status IN ('delivered', 'read')
+          AND COALESCE(o.status, '') NOT IN ('delivered', 'read')
+      ) AS delivered,
+      COUNT(*) FILTER (
+        WHERE n.status = 'read' AND COALESCE(o.status, '') <> 'read'
+      ) AS read
+    FROM new_rows n
+    JOIN old_rows o ON o.id = n.id
+    WHERE n.campaign_id IS NOT NULL
+    GROUP BY n.campaign_id
+  ) d
+  WHERE c.id = d.campaign_id
+    AND (d.delivered > 0 OR d.read > 0);
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_campaign_funnel_counts ON message_logs;
+CREATE TRIGGER trigger_campaign_funnel_counts
+  AFTER UPDATE ON message_logs
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION bump_campaign_funnel_counts();
+
+-- One-time backfill from existing logs
+UPDATE campaigns c
+SET
+  delivered_count = s.delivered,
+  read_count = s.read
+FROM (
+  SELECT
+    campaign_id,
+    COUNT(*) FILTER (WHERE status IN ('delivered', 'read')) AS delivered,
+    COUNT(*) FILTER (WHERE status = 'read') AS read
+  FROM message_logs
+  WHERE campaign_id IS NOT NULL
+  GROUP BY campaign_id
+) s
+WHERE c.id = s.campaign_id;
+
+-- Done!
+SELECT 'Migration v7 complete!' as status;
@@ -0,0 +1,26 @@
+-- ========================================
+-- Migration v8: Indexed month-day columns for birthday/anniversary segments
+-- Run this in Supabase SQL Editor
+-- ========================================
+
+-- idx_contacts_dob / idx_contacts_anniversary index the full date, which
+-- can't answer "born on this month and day in any year". These generated
+-- columns store MMDD (e.g. 1225 for Dec 25) so segment lookups are an index
+-- range scan returning only the matching contacts.
+ALTER TABLE contacts ADD COLUMN IF NOT EXISTS dob_md SMALLINT
+  GENERATED ALWAYS AS ((EXTRACT(MONTH FROM dob) * 100 + EXTRACT(DAY FROM dob))::SMALLINT) STORED;
+
+ALTER TABLE contacts ADD COLUMN IF NOT EXISTS anniversary_md SMALLINT
+  GENERATED ALWAYS AS ((EXTRACT(MONTH FROM anniversary) * 100 + EXTRACT(DAY FROM anniversary))::SMALLINT) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_contacts_dob_md
+ON contacts(dob_md) WHERE dob_md IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_contacts_anniversary_md
+ON contacts(anniversary_md) WHERE anniversary_md IS NOT NULL;
+
+-- Example: today's birthdays
+-- SELECT * FROM contacts WHERE dob_md = EXTRACT(MONTH FROM CURRENT_DATE) * 100 + EXTRACT(DAY FROM CURRENT_DATE);
+
+-- Done!
+SELECT 'Migration v8 complete!' as status;
@@ -0,0 +1,55 @@
+-- ========================================
+-- Migration v9: Indexed substring search on contact name and phone
+-- Run this in Supabase SQL Editor (safe to re-run; re-run it to pick up
+-- the NULL-name ranking fix in search_contacts)
+-- ========================================
+
+-- `name ILIKE '%x%'` has a leading wildcard, so B-tree indexes can't help.
+-- Trigram GIN indexes can serve ILIKE/LIKE '%x%' for terms of 3+ chars.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Digits-only phone so "98765", "+91 98765" and "91-98765" all match
+ALTER TABLE contacts ADD COLUMN IF NOT EXISTS phone_digits TEXT
+  GENERATED ALWAYS AS (regexp_replace(phone, '\D', '', 'g')) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_contacts_name_trgm
+ON contacts USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_contacts_phone_digits_trgm
+ON contacts USING gin (phone_digits gin_trgm_ops);
+
+-- Ranked search: exact name, then prefix matches, then trigram similarity
+CREATE OR REPLACE FUNCTION search_contacts(q TEXT, max_results INT DEFAULT 50)
+RETURNS SETOF contacts
+LANGUAGE sql STABLE
+AS $$
+  WITH p AS (
+    SELECT
+      trim(q) AS term,
+      replace(replace(replace(trim(q), '\', '\\'), '%', '\%'), '_', '\_') AS esc,
+      -- Phone matching only for phone-like terms ("+91 98765"), as in
+      -- contact_search_filter: "Ravi 2" must not match every phone with a 2
+      CASE WHEN trim(q) ~ '^[0-9[:space:]+().-]+$'
+        THEN regexp_replace(q, '\D', '', 'g') ELSE '' END AS digits
+  )
+  SELECT c.*
+  FROM contacts c, p
+  WHERE p.term <> ''
+    AND (
+      c.name ILIKE '%' || p.esc || '%'
+      OR (length(p.digits) >= 3 AND c.phone_digits LIKE '%' || p.digits || '%')
+    )
+  ORDER BY
+    -- NULL names make these NULL, which DESC would sort first: count them as no match
+    COALESCE(lower(c.name) = lower(p.term), false) DESC,
+    COALESCE(c.name ILIKE p.esc || '%'
+      OR (length(p.digits) >= 3 AND c.phone_digits LIKE p.digits || '%'), false) DESC,
+    COALESCE(similarity(c.name, p.term), 0) DESC,
+    c.created_at DESC
+  LIMIT max_results;
+$$;
+
+-- Verify with database/verify_contact_search.sql on a local Postgres
+
+-- Done!
+SELECT 'Migration v9 complete!' as status;
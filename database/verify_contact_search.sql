@@ -0,0 +1,114 @@
+-- ========================================
+-- Verify migration v9 contact search on a LOCAL Postgres (not Supabase!)
+-- Builds a synthetic contacts table in a scratch schema and prints plans.
+--
+-- Usage:
+--   createdb bakked_search_check
+--   psql bakked_search_check -f database/verify_contact_search.sql
+--
+-- Expect "Bitmap Index Scan on idx_contacts_name_trgm" /
+-- "idx_contacts_phone_digits_trgm" in the plans below, including the
+-- search_contacts RPC. A "Seq Scan" under an early-exit Limit is fine for
+-- terms most rows match (e.g. a common first name).
+-- ========================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DROP SCHEMA IF EXISTS search_check CASCADE;
+CREATE SCHEMA search_check;
+SET search_path = search_check, public;
+
+CREATE TABLE contacts (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    phone TEXT UNIQUE NOT NULL,
+    name TEXT,
+    dob DATE,
+    anniversary DATE,
+    last_visit TIMESTAMPTZ,
+    total_visits INT DEFAULT 0,
+    tags TEXT[] DEFAULT '{}',
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- 1M synthetic contacts
+INSERT INTO contacts (phone, name, created_at)
+SELECT
+  '+91' || (9000000000 + g)::TEXT,
+  (ARRAY['Aarav','Priya','Rohan','Ananya','Vikram','Sneha','Karan','Meera','Arjun','Diya'])[1 + g % 10]
+    || ' ' ||
+  (ARRAY['Sharma','Verma','Gupta','Mehta','Iyer','Nair','Reddy','Kapoor','Singh','Joshi'])[1 + (g / 10) % 10]
+    || ' ' || g::TEXT,
+  NOW() - (g || ' seconds')::INTERVAL
+FROM generate_series(1, 1000000) AS g;
+
+-- Same DDL as migration_v9 (kept in sync by hand)
+ALTER TABLE contacts ADD COLUMN phone_digits TEXT
+  GENERATED ALWAYS AS (regexp_replace(phone, '\D', '', 'g')) STORED;
+CREATE INDEX idx_contacts_name_trgm ON contacts USING gin (name gin_trgm_ops);
+CREATE INDEX idx_contacts_phone_digits_trgm ON contacts USING gin (phone_digits gin_trgm_ops);
+
+CREATE OR REPLACE FUNCTION search_contacts(q TEXT, max_results INT DEFAULT 50)
+RETURNS SETOF contacts
+LANGUAGE sql STABLE
+AS $$
+  WITH p AS (
+    SELECT
+      trim(q) AS term,
+      replace(replace(replace(trim(q), '\', '\\'), '%', '\%'), '_', '\_') AS esc,
+      -- Phone matching only for phone-like terms ("+91 98765"), as in
+      -- contact_search_filter: "Ravi 2" must not match every phone with a 2
+      CASE WHEN trim(q) ~ '^[0-9[:space:]+().-]+$'
+        THEN regexp_replace(q, '\D', '', 'g') ELSE '' END AS digits
+  )
+  SELECT c.*
+  FROM contacts c, p
+  WHERE p.term <> ''
+    AND (
+      c.name ILIKE '%' || p.esc || '%'
+      OR (length(p.digits) >= 3 AND c.phone_digits LIKE '%' || p.digits || '%')
+    )
+  ORDER BY
+    -- NULL names make these NULL, which DESC would sort first: count them as no match
+    COALESCE(lower(c.name) = lower(p.term), false) DESC,
+    COALESCE(c.name ILIKE p.esc || '%'
+      OR (length(p.digits) >= 3 AND c.phone_digits LIKE p.digits || '%'), false) DESC,
+    COALESCE(similarity(c.name, p.term), 0) DESC,
+    c.created_at DESC
+  LIMIT max_results;
+$$;
+
+-- Phone-only contacts (as /send-message creates them) have no name
+INSERT INTO contacts (phone, name) VALUES
+  ('+915555500000', NULL),
+  ('+910000000001', '55555');
+
+ANALYZE contacts;
+
+\timing on
+
+-- What /contacts?search=98765 sends (phone-like term: name OR phone_digits)
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT * FROM contacts
+WHERE name ILIKE '%98765%' OR phone_digits ILIKE '%98765%'
+ORDER BY created_at DESC, id DESC
+LIMIT 100;
+
+-- Name search (terms with letters never add the phone clause)
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT * FROM contacts WHERE name ILIKE '%ananya kap%' LIMIT 100;
+
+-- Ranked RPC (the SQL function is inlined, so the plan shows its scans;
+-- "Function Scan" here would mean it stopped being inlinable)
+EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM search_contacts('mehta 4242', 10);
+EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM search_contacts('98765', 10);
+
+SELECT name, phone FROM search_contacts('Priya Iyer 77', 10);
+SELECT name, phone FROM search_contacts('98765', 10);
+
+-- NULL-name rows must not outrank better matches: expect the exact name
+-- match "55555" first, not the NULL-name row whose phone contains 55555
+SELECT name, phone FROM search_contacts('55555', 2);
+
+\timing off
+
+DROP SCHEMA search_check CASCADE;
@@ -68,11 +68,14 @@ export async function verifyPassword(password: string): Promise<boolean> {
 // ==================== CONTACTS ====================
 import type { Contact, ContactsResponse, GroupMembersResponse } from '@/types'
 
-export async function getContacts(page = 1, limit = 100, search?: string): Promise<ContactsResponse> {
+export async function getContacts(page = 1, limit = 100, search?: string, cursor?: string): Promise<ContactsResponse> {
   let url = `/contacts?page=${page}&limit=${limit}`
   if (search) {
     url += `&search=${encodeURIComponent(search)}`
   }
+  if (cursor) {
+    url += `&cursor=${encodeURIComponent(cursor)}`
+  }
   return fetchApi<ContactsResponse>(url)
 }
 
@@ -165,7 +168,9 @@ export async function submitTemplateToMeta(templateId: string): Promise<{
 export async function syncMetaTemplates(): Promise<{
   success: boolean
   meta_templates_found?: number
+  pages_fetched?: number
   local_updated?: number
+  elapsed_ms?: number
   error?: string
 }> {
   return fetchApi('/sync-meta-templates', {
@@ -239,6 +244,33 @@ export async function uploadMedia(file: File): Promise<string> {
   return data.storage_url
 }
 
+// Bulk import contacts from a CSV / XLSX export
+export async function importContacts(file: File): Promise<{
+  success: boolean
+  total_rows: number
+  imported: number
+  failed: number
+  errors: Array<{ row: number; phone: string | null; error: string }>
+  errors_truncated: boolean
+  elapsed_ms: number
+}> {
+  const formData = new FormData()
+  formData.append('file', file)
+
+  const response = await fetch(`${API_BASE}/contacts/import`, {
+    method: 'POST',
+    body: formData,
+  })
+
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({ detail: 'Import failed' }))
+    throw new Error(error.detail || 'Import failed')
+  }
+
+  invalidateCache()
+  return response.json()
+}
+
 // ==================== ANALYTICS (Meta API) ====================
 export async function getAnalytics(): Promise<{
   templates: Array<{
@@ -47,11 +47,15 @@ export interface Campaign {
   name: string
   group_id: string | null
   message_text: string
+  campaign_type?: string
+  status?: string // queued, running, completed, failed
   total_recipients: number
   sent_count: number
+  failed_count?: number
   delivered_count: number
   read_count: number
   sent_at: string
+  finished_at?: string | null
 }
 
 export interface MessageLog {
@@ -138,7 +142,9 @@ export interface ApiResponse<T> {
 
 export interface ContactsResponse {
   contacts: Contact[]
-  count: number
+  count: number | null // null when count_mode=none
+  count_mode?: 'exact' | 'planned' | 'estimated' | 'none'
+  next_cursor?: string | null // Pass back as `cursor` for the next page
 }
 
 export interface TemplatesResponse {
@@ -165,9 +171,22 @@ export interface SendMessageResponse {
 
 export interface BulkSendResponse {
   success: boolean
+  job_id?: string // Background campaign job (poll /campaigns/{job_id}/progress)
+  status?: string
   sent_count: number
   failed_count: number
   total: number
+  error?: string
+}
+
+export interface CampaignProgress {
+  job_id: string
+  status: string // queued, running, completed, failed
+  total: number
+  sent_count: number
+  failed_count: number
+  remaining: number
+  throughput: number // messages per second
 }
 
 // Dashboard stats